@@ -1,13 +1,184 @@
+import argparse
+import copy
+import fnmatch
 import hashlib
+import itertools
 import json
 import logging
 import os
-import shutil
-import sys
-from datetime import date, timedelta
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
 
-logging.basicConfig(filename=f"./logs/OutputLog_{date.today().strftime("%d_%m_%Y")}.log", level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s')
+from FileSortCache import HashCache
+from FileSortCopy import transfer_file
+from FileSortExternal import MERGE_BUFFER, Manifest, Record, RunWriter, iter_runs, iter_shared, merge_pass, remove_runs
+from FileSortHash import (PARTIAL_HASH_SIZE, hash_file, hash_file_partial, new_hash, partial_hash_tag,
+                          select_hash_algorithm)
+from FileSortJournal import Journal
+from FileSortLogging import SUMMARY, set_verbosity, setup_logging
+from FileSortMetrics import Metrics, timed
+from FileSortPlan import LINK_ACTIONS, MOVE_ACTIONS, Operation, Plan, rename_noreplace, replace_with_link
+from FileSortProgress import CancelToken, ProgressEvent, SortCancelled
+from FileSortRetention import ExpiryIndex, expiry_time
+from FileSortRules import RuleMatcher
+from FileSortSniff import SNIFF_SIZE, ContentSniffer
+from FileSortThrottle import create_throttle, set_io_priority, validate_io_priority
+from FileSortWatch import FileWatcher
+
+# Byte-by-byte comparison starts with small reads and doubles them up to the maximum
+COMPARE_MIN_CHUNK_SIZE = 64 * 1024
+COMPARE_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# Longest chain of reflinks followed to the file they were made from
+MAX_ORIGIN_DEPTH = 8
+
+class FileEntry(NamedTuple):
+    """ Metadata of a directory entry, collected once per scan """
+    name: str
+    path: str
+    is_file: bool
+    is_dir: bool
+    size: int
+    mtime: float
+    inode: int
+    mtime_ns: int = 0
+
+def scan_directory(path, metrics=None):
+    """ Yields a FileEntry for every file and directory in path using a single os.scandir pass
+        Only files are stat'ed, the file type and inode come from the directory listing itself
+    """
+    if metrics is not None:
+        metrics.count("listdir_calls")
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    if metrics is not None:
+                        metrics.count("stat_calls")
+                    yield FileEntry(entry.name, entry.path, True, False, stat.st_size, stat.st_mtime, entry.inode(),
+                                    stat.st_mtime_ns)
+                elif entry.is_dir():
+                    yield FileEntry(entry.name, entry.path, False, True, 0, 0.0, entry.inode())
+            except FileNotFoundError:
+                # Removed while scanning
+                continue
+
+def walk_files(path, metrics=None):
+    """ Yields a FileEntry for every file below path, subdirectories are scanned iteratively
+        Symlinked folders are skipped, they may point back into the tree
+    """
+    directories = [path]
+    while directories:
+        for entry in scan_directory(directories.pop(), metrics):
+            if entry.is_file:
+                yield entry
+            elif entry.is_dir and not os.path.islink(entry.path):
+                directories.append(entry.path)
+
+# Counters of a run and their label in the summary of a download folder, summed over all download folders
+STAT_COUNTERS = {"filesFound": "found", "filesRemoved": "removed", "fileDuplicates": "duplicates",
+                 "filesLinked": "linked", "filesMoved": "moved", "filesRenamed": "renamed", "filesIgnored": "ignored"}
+# DUPLICATE_ACTION values and the action of their operations
+DUPLICATE_ACTIONS = {"delete": "delete_duplicate", "hardlink": "hardlink_duplicate", "reflink": "reflink_duplicate"}
+# Stages of the external duplicate search, each one writes sorted runs of the files that are still candidates
+EXTERNAL_STAGES = ("scan", "partial", "full")
+# Files hashed at once by the external duplicate search
+EXTERNAL_HASH_CHUNK = 1024
+
+# Names created by move_file for colliding files, e.g. "invoice_12.pdf"
+COUNTER_PATTERN = re.compile(r"^(.*)_(\d+)$")
+
+class NameIndex:
+    """ Names used in a destination folder and the highest counter used for every name """
+    def __init__(self, names):
+        self.names = set()
+        self.counters = {}
+        for name in names:
+            self.add(name)
+
+    def __contains__(self, name) -> bool:
+        return name in self.names
+
+    def add(self, name) -> None:
+        self.names.add(name)
+        stem, suffix = os.path.splitext(name)
+        match = COUNTER_PATTERN.match(stem)
+        if match:
+            key = (match.group(1), suffix)
+            self.counters[key] = max(self.counters.get(key, 0), int(match.group(2)))
+
+    def discard(self, name) -> None:
+        self.names.discard(name)
+
+    def next_name(self, name) -> str:
+        """ Returns name with the next unused counter, e.g. "invoice_3001.pdf"
+            A name that already has a counter continues it, "invoice_7.pdf" becomes "invoice_8.pdf"
+        """
+        stem, suffix = os.path.splitext(name)
+        counter = 0
+        match = COUNTER_PATTERN.match(stem)
+        if match:
+            stem, counter = match.group(1), int(match.group(2))
+        counter = max(counter, self.counters.get((stem, suffix), 0)) + 1
+        return f"{stem}_{counter}{suffix}"
+
+class ContentIndex:
+    """ Files of the destination folders grouped by size
+        Partial and full hashes are only calculated for files that share a size with an incoming file
+        and are kept until the file is removed from the index.
+        The (device, inode, mtime_ns) of every file comes from its directory listing, so hard links are found
+        without a stat. It is refreshed whenever a file gets a new inode, inodes of removed files are reused.
+    """
+    def __init__(self):
+        self.by_size = defaultdict(dict)
+        self.sizes = {}
+        self.inodes = {}
+
+    def add(self, path, size, inode=None) -> None:
+        self.by_size[size][path] = {}
+        self.sizes[path] = size
+        self.inodes[path] = inode
+
+    def update_inode(self, path, stat) -> None:
+        if path in self.inodes:
+            self.inodes[path] = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+    def discard(self, path) -> None:
+        self.inodes.pop(path, None)
+        size = self.sizes.pop(path, None)
+        if size is not None:
+            del self.by_size[size][path]
+            if not self.by_size[size]:
+                del self.by_size[size]
+
+    def candidates(self, size) -> list:
+        return list(self.by_size.get(size, ()))
+
+    def get_inode(self, path):
+        """ Returns (device, inode, mtime_ns) of a file as it was last seen, None if it is unknown """
+        return self.inodes.get(path)
+
+    def get_hash(self, path, partial):
+        return self.by_size[self.sizes[path]][path].get(partial)
+
+    def set_hash(self, path, partial, digest) -> None:
+        self.by_size[self.sizes[path]][path][partial] = digest
+
+    def move(self, path, new_path, stat=None) -> None:
+        """ Moves the entry of a moved file, calculated hashes are kept
+            stat of the new path replaces the identity of a file that was copied to another file system
+        """
+        size = self.sizes.pop(path, None)
+        if size is not None:
+            self.by_size[size][new_path] = self.by_size[size].pop(path)
+            self.sizes[new_path] = size
+            self.inodes[new_path] = self.inodes.pop(path, None)
+            if stat is not None:
+                self.update_inode(new_path, stat)
 
 class FileSorter:
     def __init__(self, config_layout):
@@ -15,17 +186,99 @@ class FileSorter:
         self.filesFound: int = 0
         self.filesRemoved: int = 0
         self.fileDuplicates: int = 0
+        self.filesLinked: int = 0
         self.filesMoved: int = 0
         self.filesRenamed: int = 0
         self.filesIgnored: int = 0
+        self.processed_files: int = 0
+        self.processed_bytes: int = 0
+        self.total_files: int = 0
         self.root_path = os.getcwd()
         self.current_task = None
+        # Progress events are put into this queue if it is set, e.g. by the GUI
+        self.progress_queue = None
+        self.cancel_token = CancelToken()
+        self.hash_executor = None
+        self.hash_executor_lock = threading.Lock()
+        # Sorter that created this one for a download folder, it owns the hash worker pool
+        self.parent = None
+        self.metrics = Metrics()
+        # Device ids of directories, used to tell renames from copies
+        self.devices: dict = {}
+        # Directory listings of the current run: {directory: {name: FileEntry}}
+        self.listings: dict = {}
+        # Name indexes of destination folders: {directory: NameIndex}
+        self.name_indexes: dict = {}
+        self.content_index = None
+        # Planned targets of files which are still at their source: {source: target}, None for removals
+        self.planned_paths: dict = {}
+        # Expiry times of the listed files in folders with retention and of the logs
+        self.expiry_index = ExpiryIndex()
+        self.log_expiry = ExpiryIndex()
+        # Sorters of the download folders of the current run, only this sorter when there is one folder
+        self.root_sorters: list = [self]
+        # Counters of every download folder of a run with several folders: {path: {counter: value}}
+        self.root_stats: dict = {}
+        self.log_prefix = ""
         
         try:
             self.config: dict = self.load_config(config_layout=config_layout)
         except FileNotFoundError:
             logging.error("No config.json file found!")
             quit()
+        # All paths are absolute, the working directory is never changed
+        self.download_path = os.path.abspath(self.config.get("DOWNLOAD_FOLDER_PATH"))
+        self.log_base = self.download_path
+        self.compile_rules()
+        self.apply_log_settings()
+
+        self.hash_cache = None
+        if self.config.get("HASH_CACHE", True):
+            cache_path = self.config.get("HASH_CACHE_PATH", os.path.join(self.root_path, "hash_cache.sqlite"))
+            self.hash_cache = HashCache(db_path=cache_path,
+                                        max_entries=self.config.get("HASH_CACHE_MAX_ENTRIES", 1_000_000))
+
+        # "auto" picks the fastest algorithm of this host, the benchmark result is cached next to config.json
+        self.hash_algorithm: str = self.config.get("HASH_ALGORITHM", "sha256")
+        if self.hash_algorithm == "auto":
+            self.hash_algorithm = select_hash_algorithm(os.path.join(self.root_path, "hash_benchmark.json"))
+        try:
+            new_hash(self.hash_algorithm)
+        except ValueError as e:
+            logging.error(f"Invalid HASH_ALGORITHM {self.hash_algorithm}: {e}")
+            quit()
+
+        # Duplicates are removed or replaced by a link to the file that is kept
+        self.duplicate_action: str = self.config.get("DUPLICATE_ACTION", "delete")
+        if self.duplicate_action not in DUPLICATE_ACTIONS:
+            logging.error(f"Invalid DUPLICATE_ACTION {self.duplicate_action}, use one of {', '.join(DUPLICATE_ACTIONS)}")
+            quit()
+
+        # Disk I/O of hashing, comparing, copying and file operations is paced by IO_* settings, None when unlimited
+        self.io_priority: str = self.config.get("IO_PRIORITY", "normal")
+        if not validate_io_priority(self.io_priority):
+            logging.error(f"Invalid IO_PRIORITY {self.io_priority}, use normal, idle, best_effort[:0-7], "
+                          "realtime[:0-7] or nice[:n]")
+            quit()
+        # Threads whose I/O priority was set, a thread keeps its priority for its lifetime
+        self.prioritized_threads: set = set()
+        self.throttle = create_throttle(self.config)
+
+        # Hash worker pool, "thread" works well because hashlib releases the GIL while hashing
+        self.hash_workers: int = self.config.get("HASH_WORKERS", min(4, os.cpu_count() or 1))
+        self.hash_worker_mode: str = self.config.get("HASH_WORKER_MODE", "thread")
+
+        # Settings of the staged comparison in are_files_same
+        self.compare_samples: int = self.config.get("COMPARE_SAMPLES", 8)
+        self.compare_sample_size: int = self.config.get("COMPARE_SAMPLE_SIZE", 4 * 1024)
+        self.compare_hash_threshold: int = self.config.get("COMPARE_HASH_THRESHOLD", 1 * 1024 * 1024 * 1024)
+        # Number of comparisons decided by each stage of are_files_same
+        self.comparisons_decided: dict = {"size": 0, "cached hash": 0, "samples": 0, "hash": 0, "bytes": 0}
+
+        # Journal of the executed plan, lets an interrupted run be resumed
+        self.journal = None
+        if self.config.get("JOURNAL", True):
+            self.journal = Journal(path=self.get_journal_path(), sync_interval=self.config.get("JOURNAL_SYNC_INTERVAL", 1000))
         
     def load_config(self, config_layout: dict):
         try:
@@ -46,174 +299,1256 @@ class FileSorter:
             open(file="config.json",mode="w").write(json.dumps(config_layout))
             logging.info("Config file was created, please change!")
 
-    def calculate_hash(self, file_path, hash_func=hashlib.sha256):
-        """Calculate the hash of a file."""
-        with open(file=file_path, mode='rb') as f:
-            file_hash = hash_func()
-            while chunk := f.read(8192):  # Read in 8KB chunks
-                file_hash.update(chunk)
-            return file_hash.hexdigest()
+    def reload_config(self, config_layout: dict) -> None:
+        """ Reload config.json, e.g. after it was saved by the GUI """
+        self.config = self.load_config(config_layout=config_layout)
+        self.download_path = self.log_base = os.path.abspath(self.config.get("DOWNLOAD_FOLDER_PATH"))
+        self.compile_rules()
+        self.apply_log_settings()
+        self.throttle = create_throttle(self.config)
+
+    def apply_log_settings(self) -> None:
+        """ Set the log verbosity and the interval of progress lines from the config """
+        set_verbosity(self.config.get("LOG_VERBOSITY", "action"))
+        # Lines about every file are only built when they are written
+        self.log_files: bool = logging.getLogger().isEnabledFor(logging.DEBUG)
+        self.progress_interval: float = self.config.get("LOG_PROGRESS_INTERVAL", 5)
+        self.last_progress_log: float = 0.0
+
+    def compile_rules(self) -> None:
+        """ Compile FOLDERS and FOLDER_RULES into the matcher used by check_file, and EXCLUDE_PATTERNS """
+        self.rules = RuleMatcher(folders=self.config.get("FOLDERS"),
+                                 folder_rules=self.config.get("FOLDER_RULES", {}),
+                                 case_sensitive=self.config.get("CASE_SENSITIVE_SUFFIXES", False))
+        # Folders with their own retention: {path: delete_after_days}
+        self.folder_retention = {os.path.join(self.download_path, folder): rules["delete_after_days"]
+                                 for folder, rules in self.config.get("FOLDER_RULES", {}).items()
+                                 if "delete_after_days" in rules}
+        patterns = self.config.get("EXCLUDE_PATTERNS", [])
+        self.exclude_pattern = re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns)) if patterns else None
+        # Files that no rule matches are classified by their first bytes
+        self.sniffer = ContentSniffer() if self.config.get("SNIFF_CONTENT", False) else None
+
+    def is_excluded(self, path) -> bool:
+        """ Checks EXCLUDE_PATTERNS against the name and the path relative to the download folder """
+        if self.exclude_pattern is None:
+            return False
+        relative = os.path.relpath(path, self.download_path).replace(os.sep, "/")
+        return bool(self.exclude_pattern.match(os.path.basename(path)) or self.exclude_pattern.match(relative))
+
+    def get_download_paths(self) -> list:
+        """ Returns the absolute paths of DOWNLOAD_FOLDER_PATH and DOWNLOAD_FOLDER_PATHS """
+        paths = [self.config.get("DOWNLOAD_FOLDER_PATH")] + self.config.get("DOWNLOAD_FOLDER_PATHS", [])
+        return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+    def get_journal_path(self) -> str:
+        """ Returns JOURNAL_PATH, every further download folder has its own journal next to it """
+        path = self.config.get("JOURNAL_PATH", os.path.join(self.root_path, "journal.jsonl"))
+        if self.download_path != os.path.abspath(self.config.get("DOWNLOAD_FOLDER_PATH")):
+            stem, suffix = os.path.splitext(path)
+            path = f"{stem}_{hashlib.sha1(os.fsencode(self.download_path)).hexdigest()[:12]}{suffix}"
+        return path
+
+    def create_root_sorter(self, download_path, log_base):
+        """ Returns a sorter for one of several download folders
+            It shares config, hash cache and hash workers with this sorter, counters and state of a run are its own
+        """
+        sorter = copy.copy(self)
+        sorter.parent = self
+        sorter.hash_executor = None
+        sorter.download_path = download_path
+        sorter.log_base = log_base
+        sorter.log_prefix = f"{os.path.relpath(download_path, log_base)}: "
+        sorter.root_sorters = [sorter]
+        for name in STAT_COUNTERS:
+            setattr(sorter, name, 0)
+        sorter.comparisons_decided = dict.fromkeys(self.comparisons_decided, 0)
+        sorter.metrics = Metrics()
+        sorter.metrics.hooks = self.metrics.hooks
+        sorter.devices = {}
+        sorter.compile_rules()
+        if self.journal is not None:
+            sorter.journal = Journal(path=sorter.get_journal_path(), sync_interval=self.journal.sync_interval)
+        return sorter
+
+    def get_root_sorter(self, path):
+        """ Returns the sorter of the download folder containing path """
+        directory = os.path.dirname(os.path.abspath(path))
+        for sorter in self.root_sorters:
+            if directory == sorter.download_path:
+                return sorter
+        return self
+
+    def apply_io_priority(self) -> None:
+        """ Set IO_PRIORITY for the calling thread once, worker threads and processes started later inherit it """
+        thread = threading.get_ident()
+        if self.io_priority == "normal" or thread in self.prioritized_threads:
+            return
+        self.prioritized_threads.add(thread)
+        if set_io_priority(self.io_priority):
+            logging.log(SUMMARY, f"I/O priority set to {self.io_priority}")
+
+    def get_hash_executor(self):
+        """Returns the hash worker pool, None when hashing runs serially.
+        Sorters of download folders use the pool of their parent, which is started again after a shutdown.
+        """
+        if self.parent is not None:
+            return self.parent.get_hash_executor()
+        if self.hash_workers <= 1:
+            return None
+        with self.hash_executor_lock:
+            if self.hash_executor is None:
+                if self.hash_worker_mode == "process":
+                    self.hash_executor = ProcessPoolExecutor(max_workers=self.hash_workers)
+                else:
+                    self.hash_executor = ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix="hash")
+                logging.log(SUMMARY, f"Started {self.hash_workers} hash workers ({self.hash_worker_mode} mode)")
+            return self.hash_executor
+
+    def shutdown_hash_workers(self) -> None:
+        if self.parent is not None:
+            self.parent.shutdown_hash_workers()
+            return
+        with self.hash_executor_lock:
+            if self.hash_executor is not None:
+                self.hash_executor.shutdown()
+                self.hash_executor = None
+
+    def hash_files(self, files, partial=False, algorithm=None) -> dict:
+        """Hash a list of (path, size) tuples on the hash worker pool.
+        Cached hashes are used first, unreadable files are logged and left out of the result.
+        Returns {path: hash}.
+        """
+        algorithm = algorithm or self.hash_algorithm
+        # Hashes are stored under the name of their algorithm, so hashes of different algorithms are never compared
+        cache_key = partial_hash_tag(algorithm) if partial else algorithm
+        hashes = {}
+        missing = []
+        for file, size in files:
+            try:
+                stat = os.stat(file)
+                self.metrics.count("stat_calls")
+            except OSError as e:
+                logging.warning(f"Could not read {file}: {e}")
+                continue
+            digest = self.hash_cache.get(file, cache_key, stat=stat) if self.hash_cache else None
+            if digest is None:
+                missing.append((file, stat))
+            else:
+                hashes[file] = digest
+
+        executor = self.get_hash_executor() if len(missing) > 1 else None
+        if executor is None:
+            results = ((file, stat, None) for file, stat in missing)
+        else:
+            # Worker processes can not share the throttle, their reads are paced per file when they are submitted
+            throttle = self.throttle if self.hash_worker_mode != "process" else None
+            results = []
+            for file, stat in missing:
+                if self.throttle is not None and throttle is None:
+                    self.throttle.acquire(min(stat.st_size, 2 * PARTIAL_HASH_SIZE) if partial else stat.st_size)
+                results.append((file, stat, executor.submit(hash_file_partial, file, stat.st_size, algorithm, throttle)
+                                if partial else executor.submit(hash_file, file, algorithm, throttle)))
+
+        # Results are collected in submission order to keep the log output identical to the serial path
+        for file, stat, future in results:
+            if self.cancel_token.cancelled:
+                if executor is not None:
+                    for _, _, pending in results:
+                        pending.cancel()
+                raise SortCancelled()
+            try:
+                if future is not None:
+                    digest = future.result()
+                elif partial:
+                    digest = hash_file_partial(file, stat.st_size, algorithm, self.throttle)
+                else:
+                    digest = hash_file(file, algorithm, self.throttle)
+            except OSError as e:
+                logging.warning(f"Could not read {file}: {e}")
+                continue
+            if self.hash_cache is not None:
+                self.hash_cache.put(file, cache_key, digest, stat=stat)
+            self.metrics.count("bytes_hashed", min(stat.st_size, 2 * PARTIAL_HASH_SIZE) if partial else stat.st_size)
+            hashes[file] = digest
+        return hashes
+
+    def calculate_hash(self, file_path, algorithm=None):
+        """Calculate the hash of a file, HASH_ALGORITHM is used by default."""
+        algorithm = algorithm or self.hash_algorithm
+        stat = os.stat(file_path)
+        self.metrics.count("stat_calls")
+        digest = self.hash_cache.get(file_path, algorithm, stat=stat) if self.hash_cache else None
+        if digest is None:
+            digest = hash_file(file_path, algorithm, self.throttle)
+            self.metrics.count("bytes_hashed", stat.st_size)
+            if self.hash_cache is not None:
+                self.hash_cache.put(file_path, algorithm, digest, stat=stat)
+        return digest
+
+    def get_cached_hash(self, file_path, algorithm=None):
+        """Returns the cached hash of a file without reading it, None if it is not cached."""
+        if self.hash_cache is None:
+            return None
+        return self.hash_cache.get(file_path, algorithm or self.hash_algorithm)
     
+    def compare_sampled_blocks(self, file1, file2, size) -> bool:
+        """Compare the first and last block and evenly spaced blocks in between.
+        Files of up to COMPARE_SAMPLES blocks are compared completely.
+        """
+        block = self.compare_sample_size
+        if size <= block * self.compare_samples:
+            offsets = range(0, size, block)
+        else:
+            last = size - block
+            offsets = [last * i // max(self.compare_samples - 1, 1) for i in range(self.compare_samples)]
+        fd1 = os.open(file1, os.O_RDONLY)
+        try:
+            fd2 = os.open(file2, os.O_RDONLY)
+            try:
+                self.metrics.count("bytes_compared", 2 * block * len(offsets))
+                if self.throttle is not None:
+                    self.throttle.acquire(2 * block * len(offsets))
+                return all(os.pread(fd1, block, offset) == os.pread(fd2, block, offset) for offset in offsets)
+            finally:
+                os.close(fd2)
+        finally:
+            os.close(fd1)
+
     def compare_filebytes(self, file1, file2):
-        """Compare two files byte-by-byte."""
+        """Compare two files byte-by-byte.
+        Reads grow from COMPARE_MIN_CHUNK_SIZE to COMPARE_MAX_CHUNK_SIZE, so files that differ early
+        exit after a few reads and identical files are read with large sequential requests.
+        """
         with open(file=file1, mode='rb') as f1, open(file=file2, mode='rb') as f2:
+            if hasattr(os, "posix_fadvise"):
+                for f in (f1, f2):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            chunk_size = COMPARE_MIN_CHUNK_SIZE
             while True:
-                chunk1 = f1.read(8192)
-                chunk2 = f2.read(8192)
+                if self.throttle is not None:
+                    chunk1 = self.throttle.read(f1.read, chunk_size)
+                    chunk2 = self.throttle.read(f2.read, chunk_size)
+                else:
+                    chunk1 = f1.read(chunk_size)
+                    chunk2 = f2.read(chunk_size)
+                self.metrics.count("bytes_compared", len(chunk1) + len(chunk2))
                 if chunk1 != chunk2:
                     return False
                 if not chunk1:  # EOF reached
                     break
+                chunk_size = min(chunk_size * 2, COMPARE_MAX_CHUNK_SIZE)
             return True
         
-    def are_files_same(self,file1, file2, size_threshold=1 * 1024 * 1024 * 1024) -> bool:
+    @timed("are_files_same")
+    def are_files_same(self, file1, file2, size_threshold=None) -> bool:
         """
-        Check if two files are the same.
-        - Use hashing for small files.
-        - Use byte-by-byte comparison for large files. (file >= 1Gb)
+        Check if two files are the same, every stage only runs if the previous ones could not decide.
+        1. Compare file sizes.
+        2. Compare cached hashes if both files were hashed before.
+        3. Compare sampled blocks (start, end and COMPARE_SAMPLES - 2 blocks in between).
+        4. Compare hashes for files up to size_threshold (COMPARE_HASH_THRESHOLD), the hashes are cached.
+        5. Compare byte-by-byte for larger files.
+        The deciding stage is counted in comparisons_decided.
         """
+        if size_threshold is None:
+            size_threshold = self.compare_hash_threshold
         
         # Step 1: Compare file sizes
         size1 = os.path.getsize(file1)
         size2 = os.path.getsize(file2)
+        self.metrics.count("stat_calls", 2)
         if size1 != size2:
+            self.comparisons_decided["size"] += 1
             return False
 
-        # Step 2: Decide method based on size
+        # Step 2: Use cached hashes when both files were hashed before
+        hash1 = self.get_cached_hash(file1)
+        hash2 = self.get_cached_hash(file2) if hash1 is not None else None
+        if hash1 is not None and hash2 is not None:
+            self.comparisons_decided["cached hash"] += 1
+            return hash1 == hash2
+
+        # Step 3: Compare samples, small files are compared completely here
+        if self.compare_samples > 0:
+            same = self.compare_sampled_blocks(file1, file2, size1)
+            if not same or size1 <= self.compare_sample_size * self.compare_samples:
+                self.comparisons_decided["samples"] += 1
+                return same
+
+        # Step 4: Decide method based on size
         if size1 > size_threshold:  # If file size exceeds threshold, use byte-by-byte
-            if not self.compare_filebytes(file1, file2):
-                return False
-        else:  # Use hashing for smaller files
-            hash1 = self.calculate_hash(file1)
-            hash2 = self.calculate_hash(file2)
-            if hash1 != hash2:
-                return False
+            self.comparisons_decided["bytes"] += 1
+            return self.compare_filebytes(file1, file2)
 
-        self.fileDuplicates += 1
-        return True
+        # Use hashing for smaller files, both files are hashed concurrently
+        self.comparisons_decided["hash"] += 1
+        hashes = self.hash_files([(file1, size1), (file2, size2)])
+        return len(hashes) == 2 and hashes[file1] == hashes[file2]
     
-    def move_file(self, file, folder):
-        filename, suffix = os.path.splitext(file)
-    
-        #Check if filename already exists
-        if os.path.exists(f"{folder}/{file}"):
-            
-            #Check if files are the same when duplicates are not allowed
-            if not self.config.get("ALLOW_DUPLICATES"):
-                if self.are_files_same(file1=file, file2=f"{folder}/{file}"):
-                    os.remove(file)
-                    self.filesRemoved += 1
-                    logging.info(f"{file} was a duplicate and was removed")
-                    return
-            
-            #When filename already exists, but duplicates are allowed or files are not the same
-            counter = 1
-            while True:
-                if os.path.exists(f"{folder}/{filename}_{counter}{suffix}"): 
-                    counter += 1
+    def list_directory(self, path) -> list:
+        """ Returns the entries of a directory, every directory is only scanned once per run """
+        path = os.path.abspath(path)
+        if path not in self.listings:
+            self.listings[path] = {entry.name: entry for entry in scan_directory(path, self.metrics)}
+            if self.retention_days(path) is not None:
+                for entry in self.listings[path].values():
+                    self.track_expiry(path, entry)
+        return list(self.listings[path].values())
+
+    def forget_entry(self, path):
+        """ Removes a moved or deleted file from the directory listings, returns its FileEntry if known """
+        directory, name = os.path.split(os.path.abspath(path))
+        if self.content_index is not None:
+            self.content_index.discard(os.path.join(directory, name))
+        self.expiry_index.discard(os.path.join(directory, name))
+        listing = self.listings.get(directory)
+        return listing.pop(name, None) if listing is not None else None
+
+    def retention_days(self, directory):
+        """ Returns the retention in days of the files of a directory, None if they are kept
+            DELETE_FILES_AFTER_DAYS applies to the download folder and its direct subfolders,
+            delete_after_days in FOLDER_RULES overrides it for a folder
+        """
+        if directory in self.folder_retention:
+            days = self.folder_retention[directory]
+        else:
+            if directory != self.download_path and os.path.dirname(directory) != self.download_path:
+                return None
+            days = self.config.get("DELETE_FILES_AFTER_DAYS")
+        return days if days > 0 else None
+
+    def track_expiry(self, directory, entry) -> None:
+        """ Adds a file of a listed directory to the expiry index """
+        days = self.retention_days(directory)
+        if days is not None and entry.is_file:
+            self.expiry_index.add(os.path.join(directory, entry.name), expiry_time(entry.mtime, days))
+
+    def remember_entry(self, path, entry) -> None:
+        """ Adds a moved file to the listing of its new directory if that directory was already scanned """
+        directory, name = os.path.split(os.path.abspath(path))
+        listing = self.listings.get(directory)
+        if listing is None:
+            return
+        if entry is None:
+            # The file appeared after its directory was scanned
+            stat = os.stat(path)
+            entry = FileEntry(name, path, True, False, stat.st_size, stat.st_mtime, stat.st_ino, stat.st_mtime_ns)
+        listing[name] = entry._replace(name=name, path=os.path.join(directory, name))
+        self.track_expiry(directory, listing[name])
+
+    def get_name_index(self, folder) -> NameIndex:
+        """ Returns the name index of a destination folder, built once per run """
+        path = os.path.abspath(folder)
+        if path not in self.name_indexes:
+            self.name_indexes[path] = NameIndex(entry.name for entry in self.list_directory(path))
+        return self.name_indexes[path]
+
+    def claim_name(self, folder, name, planned=False) -> str:
+        """ Reserves a free name in folder by creating an empty placeholder file exclusively
+            Names taken by other processes in the meantime are skipped
+            planned names were already added to the name index while planning
+        """
+        names = self.get_name_index(folder)
+        if name in names and not planned:
+            name = names.next_name(name)
+        while True:
+            try:
+                os.close(os.open(os.path.join(folder, name), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                names.add(name)
+                return name
+            except FileExistsError:
+                names.add(name)
+                name = names.next_name(name)
+
+    def get_content_index(self) -> ContentIndex:
+        """ Returns the content index of all destination folders, built once per run from their listings """
+        if self.content_index is None:
+            self.content_index = ContentIndex()
+            for folder in self.config.get("FOLDERS"):
+                folder = os.path.join(self.download_path, folder)
+                if os.path.isdir(folder):
+                    device = self.get_device(folder)
+                    for entry in self.list_directory(folder):
+                        if entry.is_file:
+                            self.content_index.add(entry.path, entry.size, (device, entry.inode, entry.mtime_ns))
+        return self.content_index
+
+    def content_identity(self, path, stat=None):
+        """ Returns (device, inode) of the data of a file, None if it can not be read
+            Hard links share their inode, reflinks created by an earlier run return the inode of their origin
+            while neither of them changed since. Files with different identities may still have the same content.
+        """
+        if stat is None:
+            try:
+                stat = os.stat(path)
+                self.metrics.count("stat_calls")
+            except OSError as e:
+                logging.warning(f"Could not read {path}: {e}")
+                return None
+        # A reflink of a reflink leads to the first origin, the depth guards against cycles of reused inodes
+        for _ in range(MAX_ORIGIN_DEPTH):
+            origin = self.hash_cache.get_origin(stat) if self.hash_cache is not None else None
+            if origin is None:
+                break
+            self.metrics.count("stat_calls")
+            stat = origin[1]
+        return stat.st_dev, stat.st_ino
+
+    def is_unchanged(self, path, size, known) -> bool:
+        """ Checks if path is still the file (device, inode, mtime_ns) of the content index with the same size """
+        try:
+            stat = os.stat(path)
+            self.metrics.count("stat_calls")
+        except OSError:
+            return False
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size) == (*known, size)
+
+    def find_stored_duplicate(self, file, size):
+        """ Returns a file of the destination folders with the same content as file, None if there is none
+            A file sharing the data of file, i.e. a hard link or the origin of a reflink, is found without reading it.
+            Other files of the same size are hashed, first partially and then completely
+        """
+        index = self.get_content_index()
+        file = os.path.abspath(file)
+        candidates = index.candidates(size)
+        if candidates:
+            # Only a shortcut, files whose inodes differ are still compared by their hashes
+            identity = self.content_identity(file)
+            for path in candidates:
+                known = index.get_inode(path)
+                if identity is not None and known is not None and known[:2] == identity and \
+                        self.is_unchanged(path, size, known):
+                    return path
+        stages = [True] if size <= 2 * PARTIAL_HASH_SIZE else [True, False]
+        if size > self.compare_hash_threshold:
+            # Very large files are compared byte-by-byte instead of being hashed completely
+            stages = [True]
+        for partial in stages:
+            if not candidates:
+                return None
+            missing = [(path, size) for path in candidates if index.get_hash(path, partial) is None]
+            hashes = self.hash_files([(file, size)] + missing, partial=partial)
+            for path, _ in missing:
+                if path in hashes:
+                    index.set_hash(path, partial, hashes[path])
+            if file not in hashes:
+                return None
+            candidates = [path for path in candidates if index.get_hash(path, partial) == hashes[file]]
+        if size > self.compare_hash_threshold:
+            candidates = [path for path in candidates if self.are_files_same(file, path)]
+        return candidates[0] if candidates else None
+
+    def get_device(self, directory) -> int:
+        """ Returns the device id of a directory, every directory is only stat'ed once """
+        directory = os.path.abspath(directory)
+        if directory not in self.devices:
+            self.devices[directory] = os.stat(directory).st_dev
+            self.metrics.count("stat_calls")
+        return self.devices[directory]
+
+    def plan_file(self, plan, entry, expire=True, suffix=None) -> None:
+        """ Add the operations for a file of the download folder to plan
+            suffix is the sniffed type of a file that no rule matched by its name
+            The listings are updated as if the operations were executed, no file is changed
+        """
+        self.filesFound += 1
+
+        folder = self.rules.match(entry.name, entry.size)
+        if folder is None and suffix is not None:
+            folder = self.rules.match(entry.name + suffix, entry.size)
+        # Files expire by the retention of the folder they would be moved to
+        days = self.retention_days(os.path.join(self.download_path, folder) if folder is not None
+                                   else os.path.dirname(entry.path))
+        if expire and days is not None and expiry_time(entry.mtime, days) <= time.time():
+            # Expired files are removed right away instead of being moved first
+            plan.add(Operation("expire", entry.path, size=entry.size))
+            self.forget_entry(entry.path)
+            self.planned_paths[entry.path] = None
+            return
+
+        if folder is None:
+            logging.info(f"No folder for {self.relative_path(entry.path)}")
+            self.filesIgnored += 1
+            return
+
+        #Check if the content already exists in any destination folder when duplicates are not allowed
+        if not self.config.get("ALLOW_DUPLICATES"):
+            duplicate = self.find_stored_duplicate(entry.path, entry.size)
+            if duplicate is not None:
+                if self.duplicate_action == "delete":
+                    plan.add(Operation("delete_duplicate", entry.path, size=entry.size,
+                                       original=self.planned_paths.get(duplicate, duplicate)))
+                    self.forget_entry(entry.path)
+                    self.planned_paths[entry.path] = None
+                elif self.content_identity(entry.path) == self.content_identity(duplicate):
+                    # Linked by an earlier run, the file stays where it is
+                    if self.log_files:
+                        logging.debug(f"File {entry.name} is already linked to {self.relative_path(duplicate)}.")
                 else:
-                    break
-            
-            newFilename = f"{filename}_{counter}{suffix}"
-            os.rename(file,newFilename)
-            self.filesRenamed += 1
-            logging.info(f"{file} was renamed to {newFilename}")
-            file = newFilename
+                    # The duplicate stays where it is as a link to the stored file
+                    plan.add(Operation(DUPLICATE_ACTIONS[self.duplicate_action], entry.path, size=entry.size,
+                                       original=self.planned_paths.get(duplicate, duplicate)))
+                return
 
-        shutil.move(src=f"{os.getcwd()}/{file}", dst=f"{os.getcwd()}/{folder}/{file}")
-        self.filesMoved += 1
-        logging.info(f"{file} was moved to {folder}")
-    
-    def remove_file_after_time(self, file, days) -> None:
-        if days < 0: return
-       
-        remove_date: date = (date.today() - timedelta(days=days))
-        file_date: date = date.fromtimestamp(os.path.getmtime(file))
-        
-        if file_date < remove_date:
-            os.remove(file)
+        #When filename already exists, but duplicates are allowed or files are not the same
+        folder = os.path.join(self.download_path, folder)
+        names = self.get_name_index(folder)
+        name = names.next_name(entry.name) if entry.name in names else entry.name
+        names.add(name)
+        target = os.path.join(folder, name)
+        plan.add(Operation("move" if name == entry.name else "rename", entry.path, target, entry.size))
+
+        # The entry keeps its path until the move is executed
+        self.forget_entry(entry.path)
+        self.listings.setdefault(folder, {})[name] = entry._replace(name=name)
+        self.track_expiry(folder, self.listings[folder][name])
+        self.planned_paths[entry.path] = target
+        if self.content_index is not None:
+            self.content_index.add(entry.path, entry.size,
+                                   (self.get_device(os.path.dirname(entry.path)), entry.inode, entry.mtime_ns))
+
+    def needs_sniffing(self, entry) -> bool:
+        """ Checks if a file should be classified by its content, only when SNIFF_CONTENT is set and no rule matches """
+        return self.sniffer is not None and entry.size > 0 and self.rules.match(entry.name, entry.size) is None
+
+    def sniff_files(self, entries) -> dict:
+        """ Read the first bytes of a list of FileEntry on the hash worker pool, returns {path: suffix or None} """
+        suffixes = self.sniffer.sniff(entries, self.get_hash_executor())
+        self.metrics.count("files_sniffed", len(entries))
+        self.metrics.count("bytes_sniffed", sum(min(entry.size, SNIFF_SIZE) for entry in entries))
+        if self.log_files:
+            for entry in entries:
+                if suffixes.get(entry.path) is not None:
+                    logging.debug(f"File {entry.name} was recognized as {suffixes[entry.path]}.")
+        return suffixes
+
+    def plan_sniffed(self, plan, entries) -> None:
+        """ Plan a batch of files that no rule matched by their sniffed content and empty the batch """
+        suffixes = self.sniff_files(entries)
+        for entry in entries:
+            self.plan_file(plan, entry, suffix=suffixes.get(entry.path))
+        entries.clear()
+
+    def iter_directory(self, path):
+        """ Yields the entries of a directory, from its listing if it was already scanned in this run
+            Other directories are streamed and not added to the listings to keep the memory bounded
+        """
+        listing = self.listings.get(os.path.abspath(path))
+        if listing is not None:
+            yield from list(listing.values())
+            return
+        for entry in scan_directory(path, self.metrics):
+            # Files with pending operations are already in the listings of their planned location
+            if entry.path not in self.planned_paths:
+                yield entry
+
+    def iter_sort_entries(self):
+        """ Yields the files to sort
+            With RECURSIVE_SORT the tree below the download folder is walked iteratively up to MAX_DEPTH levels,
+            destination folders, symlinked folders and EXCLUDE_PATTERNS are skipped.
+            The files of subfolders are added to the progress total as they are found.
+        """
+        root = self.download_path
+        recursive = self.config.get("RECURSIVE_SORT", False)
+        max_depth = self.config.get("MAX_DEPTH", -1)
+        destinations = {os.path.join(root, folder) for folder in self.config.get("FOLDERS")}
+        directories = [(root, 0)]
+        while directories:
+            directory, depth = directories.pop()
+            self.cancel_token.check()
+            for entry in self.iter_directory(directory):
+                path = os.path.join(directory, entry.name)
+                if self.is_excluded(path):
+                    continue
+                if entry.is_file:
+                    if directory != root:
+                        self.total_files += 1
+                    yield entry
+                elif recursive and entry.is_dir and path not in destinations and (max_depth < 0 or depth < max_depth) \
+                        and not os.path.islink(path):
+                    directories.append((path, depth + 1))
+
+    def plan_sort(self, plan, batch=None) -> None:
+        """ Plan moving every file of the download folder to its folder
+            batch is called with the plan every SORT_BATCH_SIZE operations and at the end and has to empty it,
+            e.g. by executing it, so large trees are never planned completely in memory
+        """
+        self.begin_task("Sorting files", self.total_files)
+        batch_size = self.config.get("SORT_BATCH_SIZE", 10000)
+        # Files to classify by their content are sniffed together
+        unmatched = []
+        sniff_batch_size = self.config.get("SNIFF_BATCH_SIZE", 256)
+        for entry in self.iter_sort_entries():
+            self.cancel_token.check()
+            if self.log_files:
+                logging.debug(f"File {entry.name} was found.")
+            if self.needs_sniffing(entry):
+                unmatched.append(entry)
+                if len(unmatched) >= sniff_batch_size:
+                    self.plan_sniffed(plan, unmatched)
+            else:
+                self.plan_file(plan, entry)
+            self.advance(entry.path, entry.size)
+            if batch is not None and len(plan) >= batch_size:
+                batch(plan)
+                self.current_task = "Sorting files"
+        if unmatched:
+            self.plan_sniffed(plan, unmatched)
+        if batch is not None and plan:
+            batch(plan)
+            self.current_task = "Sorting files"
+        self.log_progress(force=True)
+
+    def plan_expire(self, plan) -> None:
+        """ Plan removing expired files from the download folder, its direct subfolders and folders with their own retention
+            Listing a folder adds its files to the expiry index, only expired files are looked at afterwards
+        """
+        self.begin_task("Removing old files")
+        root = self.download_path
+        directories = list(self.folder_retention)
+        if self.retention_days(root) is not None:
+            directories += [root] + [os.path.join(root, entry.name) for entry in self.list_directory(root) if entry.is_dir]
+        for directory in directories:
+            if directory not in self.listings and self.retention_days(directory) is not None and os.path.isdir(directory):
+                self.list_directory(directory)
+        self.plan_due_expiry(plan)
+
+    def plan_due_expiry(self, plan, now=None) -> None:
+        """ Plan removing the files of the expiry index that expired at now """
+        now = time.time() if now is None else now
+        for path in self.expiry_index.pop_expired(now):
+            directory, name = os.path.split(path)
+            entry = self.listings.get(directory, {}).get(name)
+            if entry is None:
+                continue
+            # The file may have been changed since it was listed, e.g. in watch mode
+            try:
+                stat = os.stat(entry.path)
+                self.metrics.count("stat_calls")
+            except FileNotFoundError:
+                self.forget_entry(path)
+                continue
+            if stat.st_mtime != entry.mtime:
+                entry = entry._replace(size=stat.st_size, mtime=stat.st_mtime)
+                self.listings[directory][name] = entry
+                if expiry_time(stat.st_mtime, self.retention_days(directory)) > now:
+                    self.track_expiry(directory, entry)
+                    continue
+            plan.add(Operation("expire", path, size=entry.size))
+            self.forget_entry(path)
+
+    def next_expiry(self):
+        """ Returns the time at which the next file of any download folder or log expires, None if nothing expires """
+        expiries = [sorter.expiry_index.next_expiry() for sorter in self.root_sorters] + [self.log_expiry.next_expiry()]
+        return min((expires for expires in expiries if expires is not None), default=None)
+
+    def expire_files(self) -> None:
+        """ Remove files and logs that expired since the last call, used by watch mode """
+        now = time.time()
+        expires = self.next_expiry()
+        if expires is None or expires > now:
+            return
+        for sorter in self.root_sorters:
+            plan = Plan()
+            sorter.plan_due_expiry(plan, now)
+            sorter.execute_plan(plan)
+        self.remove_expired_logs(now)
+
+    def plan_duplicates(self, plan) -> None:
+        """ Plan removing duplicates in the download folder and all its subfolders
+            Files are only compared with files in the same directory, symlinked folders are skipped.
+            The tree is walked once, files are added to the progress total as their directory is listed.
+        """
+        self.begin_task("Removing duplicates")
+        directories = [self.download_path]
+        while directories:
+            directory = directories.pop()
+            self.cancel_token.check()
+            files = []
+            # Files of planned moves are still at their source: {path on disk: (planned path, size)}
+            planned = {}
+            for entry in sorted(self.iter_directory(directory)):
+                path = os.path.join(directory, entry.name)
+                if self.is_excluded(path):
+                    continue
+                if entry.is_file:
+                    files.append((entry.path, entry.size))
+                    planned[entry.path] = (path, entry.size)
+                elif entry.is_dir and not os.path.islink(path):
+                    directories.append(path)
+            self.total_files += len(files)
+
+            for group in self.find_duplicate_groups(files):
+                original, *duplicates = sorted((*planned[file], file) for file in group)
+                if self.duplicate_action == "delete":
+                    for duplicate, size, _ in duplicates:
+                        plan.add(Operation("delete_duplicate", duplicate, size=size, original=original[0]))
+                        self.forget_entry(duplicate)
+                    continue
+                identity = self.content_identity(original[2])
+                for duplicate, size, path in duplicates:
+                    # Files that are already linked to the original are left alone
+                    if self.content_identity(path) != identity:
+                        plan.add(Operation(DUPLICATE_ACTIONS[self.duplicate_action], duplicate, size=size,
+                                           original=original[0]))
+            self.advance(directory, sum(size for _, size in files), count=len(files))
+
+    def plan_external_duplicates(self, plan, batch=None) -> None:
+        """ Plan removing duplicates anywhere below the download folder with at most DEDUPE_MEMORY bytes of memory
+            A record of every file is written to sorted runs on disk, the runs are merged to find files of the same
+            size, only those are hashed partially and files sharing a partial hash completely, each stage writing
+            new runs. The manifest is saved after every stage and merge pass, an interrupted search resumes there.
+        """
+        memory = self.config.get("DEDUPE_MEMORY", 256 * 1024 * 1024)
+        # Half of the memory holds a run being written, the other half the buffers of the runs being merged
+        fan_in = max(2, min(self.config.get("DEDUPE_MERGE_FAN_IN", 64), memory // (2 * MERGE_BUFFER)))
+        directory = os.path.join(self.config.get("DEDUPE_TEMP_DIR", os.path.join(self.root_path, "dedupe")),
+                                 hashlib.sha1(os.fsencode(self.download_path)).hexdigest()[:12])
+        os.makedirs(directory, exist_ok=True)
+        manifest = Manifest(os.path.join(directory, "manifest.json"), self.download_path)
+        manifest.remove_stray_runs()
+        if manifest.stage is not None:
+            logging.log(SUMMARY, f"{self.log_prefix}Resuming duplicate search after stage {EXTERNAL_STAGES[manifest.stage]}")
+
+        for stage, name in enumerate(EXTERNAL_STAGES):
+            if manifest.stage is not None and manifest.stage > stage:
+                # Written and merged by the interrupted search
+                continue
+            if manifest.stage is None or manifest.stage < stage:
+                writer = RunWriter(directory, name, memory // 2)
+                if stage == 0:
+                    self.write_scan_runs(writer)
+                else:
+                    self.write_hash_runs(writer, manifest.runs, manifest.records, partial=name == "partial")
+                previous = manifest.runs
+                manifest.save(stage, writer.close(), writer.count)
+                remove_runs(previous)
+                logging.log(SUMMARY, f"{self.log_prefix}Duplicate search stage {name}: "
+                                     f"{writer.count} files in {len(manifest.runs)} runs")
+            while len(manifest.runs) > fan_in:
+                self.cancel_token.check()
+                previous = manifest.runs
+                runs = merge_pass(previous, directory, f"{name}_m{manifest.merges + 1}", fan_in)
+                manifest.save(stage, runs, manifest.records, manifest.merges + 1)
+                remove_runs(previous, keep=runs)
+                logging.log(SUMMARY, f"{self.log_prefix}Duplicate search stage {name}: "
+                                     f"merge pass {manifest.merges} left {len(runs)} runs")
+
+        self.plan_duplicate_records(plan, manifest.runs, manifest.records, batch)
+        manifest.remove()
+
+    def write_scan_runs(self, writer) -> None:
+        """ Write a record of every file below the download folder, symlinked folders and EXCLUDE_PATTERNS are skipped """
+        self.begin_task("Finding duplicates (scan)")
+        directories = [self.download_path]
+        while directories:
+            directory = directories.pop()
+            self.cancel_token.check()
+            try:
+                device = os.stat(directory).st_dev
+                self.metrics.count("stat_calls")
+                entries = list(scan_directory(directory, self.metrics))
+            except OSError as e:
+                logging.warning(f"Could not read {directory}: {e}")
+                continue
+            for entry in entries:
+                # Files with pending operations of a dry run are left out
+                if self.is_excluded(entry.path) or entry.path in self.planned_paths:
+                    continue
+                if entry.is_file:
+                    writer.add(Record(entry.size, "", entry.path, device, entry.inode, entry.mtime_ns))
+                    self.advance(entry.path, entry.size)
+                elif entry.is_dir and not os.path.islink(entry.path):
+                    directories.append(entry.path)
+
+    def iter_advancing(self, records):
+        """ Yields records and counts them as processed """
+        for record in records:
+            self.advance(record.path, record.size)
+            yield record
+
+    def write_hash_runs(self, writer, runs, total, partial) -> None:
+        """ Write the records of the runs that share their size (partial) or their partial hash with another record,
+            with their partial or full hash
+        """
+        self.begin_task(f"Finding duplicates ({'partial' if partial else 'full'} hash)", total)
+        key = (lambda record: record.size) if partial else (lambda record: (record.size, record.digest))
+        chunk = []
+        for record in iter_shared(self.iter_advancing(iter_runs(runs)), key):
+            chunk.append(record)
+            if len(chunk) >= EXTERNAL_HASH_CHUNK:
+                self.write_hashed_records(writer, chunk, partial)
+        if chunk:
+            self.write_hashed_records(writer, chunk, partial)
+
+    def write_hashed_records(self, writer, records, partial) -> None:
+        """ Hash a chunk of records on the hash worker pool, write them with their hash and empty the chunk """
+        self.cancel_token.check()
+        # The partial hash of small files already covers the whole file
+        files = [(record.path, record.size) for record in records if partial or record.size > 2 * PARTIAL_HASH_SIZE]
+        hashes = self.hash_files(files, partial=partial) if files else {}
+        for record in records:
+            digest = record.digest if not partial and record.size <= 2 * PARTIAL_HASH_SIZE else hashes.get(record.path)
+            if digest is not None:
+                writer.add(record._replace(digest=digest))
+        records.clear()
+
+    def record_unchanged(self, record) -> bool:
+        """ Checks if the file of a record is still the file that was scanned, unchanged since
+            Runs of a resumed search may be old and a file edited in place keeps its size, but not its mtime
+        """
+        try:
+            stat = os.stat(record.path)
+            self.metrics.count("stat_calls")
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns, stat.st_dev, stat.st_ino) == \
+            (record.size, record.mtime_ns, record.dev, record.inode)
+
+    def plan_duplicate_records(self, plan, runs, total, batch=None) -> None:
+        """ Plan removing or linking the duplicates of the hashed runs, every group keeps the file with the first path
+            batch is called with the plan every SORT_BATCH_SIZE operations like in plan_sort
+        """
+        self.begin_task("Removing duplicates", total)
+        batch_size = self.config.get("SORT_BATCH_SIZE", 10000)
+        records = self.iter_advancing(iter_runs(runs))
+        for _, group in itertools.groupby(records, key=lambda record: (record.size, record.digest)):
+            original = None
+            for record in group:
+                self.cancel_token.check()
+                if not self.record_unchanged(record):
+                    continue
+                if original is None:
+                    original = record
+                elif self.duplicate_action == "delete":
+                    plan.add(Operation("delete_duplicate", record.path, size=record.size, original=original.path))
+                elif (record.dev, record.inode) != (original.dev, original.inode) and \
+                        self.content_identity(record.path) != self.content_identity(original.path):
+                    plan.add(Operation(DUPLICATE_ACTIONS[self.duplicate_action], record.path, size=record.size,
+                                       original=original.path))
+                if batch is not None and len(plan) >= batch_size:
+                    batch(plan)
+                    self.current_task = "Removing duplicates"
+        if batch is not None and plan:
+            batch(plan)
+
+    def execute_batch(self, plan) -> None:
+        """ Execute a plan with the journal and empty it """
+        if not plan:
+            return
+        logging.log(SUMMARY, f"{self.log_prefix}Executing operations: {plan.counts()}")
+        if self.journal is not None:
+            self.journal.start(plan)
+        try:
+            self.execute_plan(plan, journal=self.journal)
+        except SortCancelled:
+            # Cancelled plans never leave a file half moved, there is nothing to resume
+            if self.journal is not None:
+                self.journal.finish()
+            raise
+        if self.journal is not None:
+            self.journal.finish()
+        plan.operations.clear()
+
+    def execute_plan(self, plan, journal=None, completed=None) -> None:
+        """ Apply the operations of a plan
+            Moves are grouped by destination folder, renames within a file system run first,
+            copies to other file systems run concurrently afterwards. Removals follow once all moves are done.
+            Failed operations are logged and skipped.
+            Completed operations are recorded in journal, operations in completed ({index: path}) are skipped.
+            A cancelled run stops before the next operation, running copies are finished first.
+        """
+        self.current_task = "Executing plan"
+        completed = completed or {}
+        # Executed operations and their size for the progress events
+        executed = [0, 0]
+
+        def operation_done(operation, path) -> None:
+            executed[0] += 1
+            executed[1] += operation.size
+            self.publish_progress(executed[0], len(plan) - len(completed), executed[1], path)
+
+        # Paths of executed moves: {planned target: actual path}
+        moved = {}
+        groups = defaultdict(list)
+        for index, operation in enumerate(plan):
+            if operation.action not in MOVE_ACTIONS:
+                continue
+            if index in completed:
+                if completed[index] is not None:
+                    moved[operation.target] = completed[index]
+                continue
+            groups[os.path.dirname(operation.target)].append((index, operation))
+
+        copies = []
+        for folder, operations in groups.items():
+            for index, operation in operations:
+                self.cancel_token.check()
+                if self.get_device(os.path.dirname(operation.source)) != self.get_device(folder):
+                    copies.append((index, operation))
+                    continue
+                try:
+                    moved[operation.target] = self.rename_file(operation)
+                except OSError as e:
+                    logging.error(f"Could not move {operation.source} to {folder}: {e}")
+                    continue
+                if journal is not None:
+                    journal.done(index, moved[operation.target])
+                self.finish_move(operation, moved[operation.target], "bytes_renamed")
+                operation_done(operation, moved[operation.target])
+
+        if copies:
+            claimed = []
+            for index, operation in copies:
+                folder, name = os.path.split(operation.target)
+                try:
+                    path = os.path.join(folder, self.claim_name(folder, name, planned=True))
+                except OSError as e:
+                    logging.error(f"Could not move {operation.source} to {folder}: {e}")
+                    continue
+                claimed.append((index, operation, path))
+                if journal is not None:
+                    journal.begin(index, path)
+            # Interrupted copies can only be cleaned up if their destinations are known
+            if journal is not None:
+                journal.sync()
+            cancelled = False
+            with ThreadPoolExecutor(max_workers=self.config.get("MOVE_WORKERS", 4)) as executor:
+                futures = [(index, operation, executor.submit(self.copy_file, operation, path))
+                           for index, operation, path in claimed]
+                for index, operation, future in futures:
+                    try:
+                        moved[operation.target] = future.result()
+                    except SortCancelled:
+                        cancelled = True
+                        continue
+                    except OSError as e:
+                        logging.error(f"Could not move {operation.source} to {os.path.dirname(operation.target)}: {e}")
+                        continue
+                    if journal is not None:
+                        journal.done(index, moved[operation.target])
+                    self.finish_move(operation, moved[operation.target], "bytes_copied")
+                    operation_done(operation, moved[operation.target])
+            if cancelled:
+                raise SortCancelled()
+
+        for index, operation in enumerate(plan):
+            if operation.action in MOVE_ACTIONS or index in completed:
+                continue
+            self.cancel_token.check()
+            if self.throttle is not None:
+                self.throttle.acquire()
+            path = moved.get(operation.source, operation.source)
+            if operation.action in LINK_ACTIONS:
+                if self.link_file(operation, path, moved.get(operation.original, operation.original)):
+                    if journal is not None:
+                        journal.done(index, path)
+                    operation_done(operation, path)
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error(f"Could not remove {path}: {e}")
+                continue
+            if journal is not None:
+                journal.done(index, path)
+            self.forget_entry(path)
             self.filesRemoved += 1
-            logging.info(f"{file} was removed because it was older than {days} days")
+            if operation.action == "delete_duplicate":
+                self.fileDuplicates += 1
+                original = moved.get(operation.original, operation.original)
+                logging.info(f"{self.relative_path(path)} was a duplicate of {self.relative_path(original)} and was removed")
+            else:
+                logging.info(f"{self.relative_path(path)} was removed because it was older than "
+                             f"{self.retention_days(os.path.dirname(path))} days")
+            operation_done(operation, path)
+        self.planned_paths = {}
+
+    def recover_operations(self, plan, begun, done) -> dict:
+        """ Check the operations of an interrupted run which are not recorded as done
+            Copies that were interrupted are rolled forward when the copy is complete, otherwise rolled back.
+            Renames and removals that happened after the last journal sync are detected by their result.
+            Returns the completed operations {index: path}, None as path for moves that can not be repeated.
+        """
+        completed = dict(done)
+        # Planned targets of moves whose result is unknown, later operations on them are skipped
+        unknown = set()
+        moved = {plan.operations[index].target: path for index, path in done.items()
+                 if path is not None and plan.operations[index].action in MOVE_ACTIONS}
+        for index, operation in enumerate(plan):
+            if index in completed:
+                continue
+            if operation.action not in MOVE_ACTIONS:
+                if operation.source in unknown:
+                    logging.warning(f"Location of {operation.source} is unknown, its {operation.action} is skipped")
+                    completed[index] = None
+                elif not os.path.lexists(moved.get(operation.source, operation.source)):
+                    completed[index] = operation.source
+                continue
+
+            path = begun.get(index)
+            if path is not None and os.path.lexists(operation.source):
+                source_stat = os.stat(operation.source)
+                try:
+                    target_stat = os.stat(path)
+                except FileNotFoundError:
+                    target_stat = None
+                # copy_file copies the modification time after the content, both match only for complete copies
+                if target_stat is not None and (target_stat.st_size, target_stat.st_mtime_ns) == \
+                        (source_stat.st_size, source_stat.st_mtime_ns):
+                    os.remove(operation.source)
+                    completed[index] = moved[operation.target] = path
+                    logging.warning(f"Interrupted move of {operation.source} to {path} was completed")
+                else:
+                    if target_stat is not None:
+                        os.remove(path)
+                    logging.warning(f"Interrupted move of {operation.source} to {path} was rolled back")
+            elif path is not None:
+                completed[index] = moved[operation.target] = path
+            elif not os.path.lexists(operation.source):
+                # Renamed after the last journal sync, usually under the planned name
+                if os.path.isfile(operation.target) and os.path.getsize(operation.target) == operation.size:
+                    completed[index] = moved[operation.target] = operation.target
+                else:
+                    logging.warning(f"{operation.source} is missing, its move to {operation.target} is skipped")
+                    completed[index] = None
+                    unknown.add(operation.target)
+        return completed
+
+    @timed("move_file")
+    def rename_file(self, operation) -> str:
+        """ Rename a file to its planned target without replacing an existing file, returns the new path
+            If the target was taken since planning the next free name is used
+        """
+        if self.throttle is not None:
+            self.throttle.acquire()
+        folder, name = os.path.split(operation.target)
+        names = self.get_name_index(folder)
+        while True:
+            try:
+                rename_noreplace(operation.source, os.path.join(folder, name))
+                return os.path.join(folder, name)
+            except FileExistsError:
+                names.add(name)
+                name = names.next_name(name)
+            except NotImplementedError:
+                break
+        # Without renameat2 the name is reserved by a placeholder which is then replaced
+        name = self.claim_name(folder, name, planned=True)
+        try:
+            os.rename(operation.source, os.path.join(folder, name))
+        except BaseException:
+            os.remove(os.path.join(folder, name))
+            names.discard(name)
+            raise
+        return os.path.join(folder, name)
+
+    @timed("move_file")
+    def copy_file(self, operation, path) -> str:
+        """ Move a file to another file system, path is the placeholder claimed for it
+            The source is removed once the copy is synced to disk, the hashes calculated while copying are cached
+            so a later duplicate search does not read the file again.
+            Copies that did not start yet when the run is cancelled release their placeholder
+        """
+        try:
+            self.cancel_token.check()
+            result = transfer_file(operation.source, path, algorithm=self.hash_algorithm,
+                                   method=self.config.get("COPY_METHOD", "hash"),
+                                   buffer_size=self.config.get("COPY_BUFFER_SIZE", 8 * 1024 * 1024),
+                                   verify=self.config.get("COPY_VERIFY", False), throttle=self.throttle)
+            os.remove(operation.source)
+        except BaseException:
+            os.remove(path)
+            self.get_name_index(os.path.dirname(path)).discard(os.path.basename(path))
+            raise
+        if result.digest is not None:
+            self.metrics.count("bytes_hashed_while_copying", operation.size)
+            if self.hash_cache is not None:
+                stat = os.stat(path)
+                self.metrics.count("stat_calls")
+                self.hash_cache.put(path, self.hash_algorithm, result.digest, stat=stat)
+                if result.partial_digest is not None:
+                    self.hash_cache.put(path, partial_hash_tag(self.hash_algorithm), result.partial_digest, stat=stat)
+        return path
+
+    @timed("link_file")
+    def link_file(self, operation, path, original) -> bool:
+        """ Replace a duplicate by a hard link or reflink to original, returns False if it failed
+            Reflinks are recorded in the hash cache, so they are known to equal original without being hashed
+        """
+        try:
+            kind = replace_with_link(path, original, reflink=operation.action == "reflink_duplicate")
+            stat = os.stat(path)
+            self.metrics.count("stat_calls")
+        except OSError as e:
+            logging.error(f"Could not link {path} to {original}: {e}")
+            return False
+        if kind == "reflink" and self.hash_cache is not None:
+            self.hash_cache.put_origin(path, original, stat=stat)
+        directory, name = os.path.split(path)
+        listing = self.listings.get(directory)
+        if listing is not None and name in listing:
+            listing[name] = listing[name]._replace(mtime=stat.st_mtime, inode=stat.st_ino,
+                                                     mtime_ns=stat.st_mtime_ns)
+            self.track_expiry(directory, listing[name])
+        if self.content_index is not None:
+            self.content_index.update_inode(path, stat)
+        self.metrics.count("bytes_linked", operation.size)
+        self.fileDuplicates += 1
+        self.filesLinked += 1
+        logging.info(f"{self.relative_path(path)} was a duplicate of {self.relative_path(original)} "
+                     f"and was replaced by a {kind}")
+        return True
 
-    def check_directories(self):
-        """ Check if Directories exist """
+    def finish_move(self, operation, path, metric) -> None:
+        """ Update listings, content index and counters after a file was moved """
+        folder, name = os.path.split(path)
+        listing = self.listings.get(folder)
+        entry = listing.pop(os.path.basename(operation.target), None) if listing is not None else None
+        # Copies to another file system get a new inode, the inode of the source may be reused by any new file
+        try:
+            stat = os.stat(path)
+            self.metrics.count("stat_calls")
+        except OSError:
+            stat = None
+        if entry is not None and stat is not None:
+            entry = entry._replace(mtime=stat.st_mtime, inode=stat.st_ino, mtime_ns=stat.st_mtime_ns)
+        self.remember_entry(path, entry)
+        if self.content_index is not None:
+            self.content_index.move(operation.source, path, stat)
+            if stat is None:
+                self.content_index.discard(path)
+        self.metrics.count(metric, operation.size)
+        self.filesMoved += 1
+        file = os.path.basename(operation.source)
+        if name != file:
+            self.filesRenamed += 1
+            logging.info(f"{file} was renamed to {name}")
+        logging.info(f"{name} was moved to {self.relative_path(folder)}")
+
+    def relative_path(self, path) -> str:
+        """ Path for log lines, relative to the download folder or to the common parent of all download folders """
+        return os.path.relpath(path, self.log_base)
+
+    def check_directories(self, create=True):
+        """ Check if Directories exist
+            With create=False missing folders are only added to the listings, e.g. for a dry run
+        """
         for folder in self.config.get("FOLDERS"):
-            if not os.path.isdir(folder):
-                os.mkdir(folder)
-                logging.info(f"Folder {folder} was created!")
+            path = os.path.join(self.download_path, folder)
+            if not os.path.isdir(path):
+                if create:
+                    os.mkdir(path)
+                    inode = os.stat(path).st_ino
+                    logging.info(f"Folder {self.relative_path(path)} was created!")
+                else:
+                    inode = 0
+                # Keep the listings of this run in sync with the new, empty folder
+                self.remember_entry(path, FileEntry(folder, path, False, True, 0, 0.0, inode))
+                self.listings[path] = {}
             else:
-                logging.info(f"Folder {folder} was found.")
+                logging.debug(f"Folder {self.relative_path(path)} was found.")
         
     def check_file(self, file):
         """ Check if file is in the config and move it to the correct folder """
-        
-        self.filesFound += 1
-    
-        for folder in self.config.get("FOLDERS"):
-            if(file.endswith(tuple(self.config.get("FOLDERS").get(folder)))):
-                self.move_file(folder=folder,file=file)
-                return
-        logging.warning(f"No folder for {file}")
-        self.filesIgnored += 1
+        path = os.path.abspath(file)
+        directory, name = os.path.split(path)
+        listing = self.listings.get(directory)
+        entry = listing.get(name) if listing is not None else None
+        if entry is None:
+            stat = os.stat(path)
+            self.metrics.count("stat_calls")
+            entry = FileEntry(name, path, True, False, stat.st_size, stat.st_mtime, stat.st_ino, stat.st_mtime_ns)
+            if listing is not None:
+                listing[name] = entry
+                self.track_expiry(directory, entry)
+        plan = Plan()
+        suffix = self.sniff_files([entry]).get(path) if self.needs_sniffing(entry) else None
+        self.plan_file(plan, entry, expire=False, suffix=suffix)
+        self.execute_plan(plan)
 
     def clean_logs(self):
+        """ Remove logs older than DELETE_LOGS_AFTER_DAYS, in watch mode further logs are removed when they expire """
         self.current_task = "Cleaning logs"
-        for file in os.listdir(f"{self.root_path}/logs"):
-            if file.endswith(".log"):
-                self.remove_file_after_time(f"./logs/{file}", self.config.get("DELETE_LOGS_AFTER_DAYS"))
+        days = self.config.get("DELETE_LOGS_AFTER_DAYS")
+        self.log_expiry = ExpiryIndex()
+        if days < 0:
+            return
+        for entry in scan_directory(f"{self.root_path}/logs", self.metrics):
+            if entry.is_file and entry.name.endswith(".log"):
+                self.log_expiry.add(entry.path, expiry_time(entry.mtime, days))
+        self.remove_expired_logs()
+
+    def remove_expired_logs(self, now=None) -> None:
+        now = time.time() if now is None else now
+        days = self.config.get("DELETE_LOGS_AFTER_DAYS")
+        for path in self.log_expiry.pop_expired(now):
+            try:
+                mtime = os.path.getmtime(path)
+                # The log of the current day is still written to
+                if expiry_time(mtime, days) > now:
+                    self.log_expiry.add(path, expiry_time(mtime, days))
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.filesRemoved += 1
+            logging.info(f"{path} was removed because it was older than {days} days")
         
-    def calculate_workload(self, args) -> None:
-        """ Calculate the total number of files to be processed """
-        os.chdir(self.config.get("DOWNLOAD_FOLDER_PATH"))
+    def calculate_workload(self) -> None:
+        """ Calculate the number of files in the download folder itself
+            Files of subfolders are counted while RECURSIVE_SORT walks them, so the tree is only walked once
+        """
         self.processed_files = 0
-        self.total_files = 0
-        
-        if 'rm_duplicates' in args:
-            self.total_files += self.count_files_in_subdirectories(self.config.get("DOWNLOAD_FOLDER_PATH"))
-        else:
-            # Count files to process (only regular files)
-            files = [f for f in os.listdir() if os.path.isfile(f)]
-            self.total_files = len(files)
+        # Count files to process (only regular files)
+        files = [entry for entry in self.list_directory(self.download_path) if entry.is_file]
+        self.total_files = len(files)
                    
-    def count_files_in_subdirectories(self, path):
-        """ Count files in subdirectories """
-        filecount = 0
-        for file in os.listdir(path):
-            full_file = os.path.join(path, file)
-            if os.path.isfile(full_file):
-                filecount += 1
-            elif os.path.isdir(full_file):
-                filecount += self.count_files_in_subdirectories(full_file)
-        return filecount
-       
     
     def sort_files(self) -> None:
         """ Sort files in the download folder """
-        self.current_task = "Sorting files"
-        
-        os.chdir(self.config.get("DOWNLOAD_FOLDER_PATH"))
-        files = [f for f in os.listdir() if os.path.isfile(f)]
-        
-        for file in files:
-            self.processed_files += 1
-            percent = int((self.processed_files / self.total_files) * 100) if self.total_files else 100
-            progress_bar = '#' * (percent // 10) + '-' * (10 - (percent // 10))
-            logging.info(f"Processing {file}: [{progress_bar}] {percent}%")
-            logging.info(f"File {file} was found.")
-            self.check_file(file)
-        logging.info("All files were sorted!")
-        if self.config.get("DELETE_FILES_AFTER_DAYS") > 0:
-            for file in os.listdir():
-                if os.path.isfile(file):
-                    self.remove_file_after_time(file, self.config.get("DELETE_FILES_AFTER_DAYS"))
-                elif os.path.isdir(file):
-                    for subfile in os.listdir(file):
-                        self.remove_file_after_time(os.path.join(file, subfile), self.config.get("DELETE_FILES_AFTER_DAYS"))
+        self.plan_sort(Plan(), batch=self.execute_batch)
+        logging.log(SUMMARY, "All files were sorted!")
+
+    def begin_task(self, task, total=0) -> None:
+        """ Starts the progress of a task, processed files and bytes count up to total """
+        self.current_task = task
+        self.processed_files = 0
+        self.processed_bytes = 0
+        self.total_files = total
+        self.publish_progress(0, total)
+
+    def advance(self, file, size, count=1) -> None:
+        """ Count files of the current task as processed, file is the last one """
+        self.processed_files += count
+        self.processed_bytes += size
+        self.publish_progress(self.processed_files, self.total_files, self.processed_bytes, file)
+        self.log_progress()
+
+    def publish_progress(self, done, total, size=0, file=None, finished=False) -> None:
+        if self.progress_queue is not None:
+            self.progress_queue.put(ProgressEvent(self.download_path, self.current_task, done, total, size, file, finished))
+
+    def log_progress(self, force=False) -> None:
+        """ Log the progress at most every LOG_PROGRESS_INTERVAL seconds """
+        now = time.monotonic()
+        if force or now - self.last_progress_log >= self.progress_interval:
+            self.last_progress_log = now
+            logging.log(SUMMARY, f"{self.log_prefix}{self.current_task}: {self.get_progress_bar()} "
+                                 f"({self.processed_files}/{self.total_files} files)")
+
+    def remove_old_files(self) -> None:
+        """ Remove files older than DELETE_FILES_AFTER_DAYS from the download folder and its direct subfolders """
+        plan = Plan()
+        self.plan_expire(plan)
+        self.execute_plan(plan)
     
     def get_progress_percent(self) -> int:
-        """Returns current progress percentage."""
-        if hasattr(self, 'total_files') and self.total_files:
-            return int((self.processed_files / self.total_files) * 100)
+        """Returns current progress percentage over all download folders."""
+        total_files = sum(sorter.total_files for sorter in self.root_sorters)
+        if total_files:
+            return min(100, int((sum(sorter.processed_files for sorter in self.root_sorters) / total_files) * 100))
         return 0
     
     def get_progress_bar(self) -> str:
@@ -227,54 +1562,286 @@ class FileSorter:
         """Returns the current task being performed."""
         return self.current_task
     
-    def remove_duplicates(self, path=None) -> None:
+    def group_files_by_hash(self, files, partial) -> list:
+        """ Group (path, size) tuples by size and hash, unreadable files are skipped """
+        hashes = self.hash_files(files, partial=partial)
+        groups = defaultdict(list)
+        for file, size in files:
+            if file in hashes:
+                groups[(size, hashes[file])].append((file, size))
+        return [group for group in groups.values() if len(group) > 1]
+
+    def find_duplicate_groups(self, files) -> list:
+        """ Find groups of identical files in a list of (path, size) tuples
+            Stage 1: group by size (no reads)
+            Stage 2: group by the data they share, hard links and reflinks of an earlier run are only hashed once
+            Stage 3: group by partial hash of the first and last bytes
+            Stage 4: group by full hash, only for files that still collide
+            Every group is sorted, the first file of a group is the one to keep
+        """
+        by_size = defaultdict(list)
+        for file, size in files:
+            by_size[size].append((file, size))
+        candidates = [group for group in by_size.values() if len(group) > 1]
+
+        # Files sharing their data by the first of them: {file: [linked files]}
+        aliases = {}
+        representatives = []
+        for group in candidates:
+            by_identity = defaultdict(list)
+            for file, _ in group:
+                identity = self.content_identity(file)
+                if identity is not None:
+                    by_identity[identity].append(file)
+            for linked in by_identity.values():
+                aliases[linked[0]] = linked
+            if len(by_identity) > 1:
+                representatives.extend((linked[0], group[0][1]) for linked in by_identity.values())
+
+        # Each stage hashes all candidates of all sizes at once to keep the hash workers busy
+        partial_groups = self.group_files_by_hash(representatives, partial=True)
+
+        hash_groups = []
+        full_candidates = []
+        for partial_group in partial_groups:
+            if partial_group[0][1] <= 2 * PARTIAL_HASH_SIZE:
+                # The partial hash already covered the whole file
+                hash_groups.append(partial_group)
+            else:
+                full_candidates.extend(partial_group)
+        hash_groups.extend(self.group_files_by_hash(full_candidates, partial=False))
+
+        duplicate_groups = []
+        grouped = set()
+        for group in hash_groups:
+            duplicate_groups.append(sorted(alias for file, _ in group for alias in aliases[file]))
+            grouped.update(file for file, _ in group)
+        # Linked files are duplicates of each other even when no other file has their content
+        for file, linked in aliases.items():
+            if file not in grouped and len(linked) > 1:
+                duplicate_groups.append(sorted(linked))
+        return sorted(duplicate_groups)
+
+    def remove_duplicates(self) -> None:
         """ Remove duplicates in the download folder
             Needs to be called with cmd argument "rm_duplicates"
-            Takes a long time for large folders
+            Files are only compared with files in the same directory
         """
-        
-        self.current_task = "Removing duplicates"
-        
-        if path is None:
-            path = self.config.get("DOWNLOAD_FOLDER_PATH")
-            logging.info(f"Using download directory: {path}")
-        
-        for file in os.listdir(path):
-            full_file = os.path.join(path, file)
-            if os.path.isfile(full_file):
-                for file2 in os.listdir(path):
-                    full_file2 = os.path.join(path, file2)
-                    if os.path.isfile(full_file2) and full_file != full_file2:
-                        if self.are_files_same(file1=full_file, file2=full_file2):
-                            os.remove(full_file2)
-                            self.filesRemoved += 1
-                            logging.info(f"{file2} was a duplicate of {file} and was removed")
-                self.processed_files += 1
-            elif os.path.isdir(full_file):
-                self.remove_duplicates(path=full_file)
+        plan = Plan()
+        self.plan_duplicates(plan)
+        self.execute_plan(plan)
                 
+    def collect_root_stats(self) -> None:
+        """ Add the counters and metrics of the other download folders to this sorter and reset them """
+        for sorter in self.root_sorters:
+            if sorter is self:
+                continue
+            stats = self.root_stats.setdefault(sorter.download_path, dict.fromkeys(STAT_COUNTERS, 0))
+            for name in STAT_COUNTERS:
+                stats[name] += getattr(sorter, name)
+                setattr(self, name, getattr(self, name) + getattr(sorter, name))
+                setattr(sorter, name, 0)
+            for stage, count in sorter.comparisons_decided.items():
+                self.comparisons_decided[stage] += count
+                sorter.comparisons_decided[stage] = 0
+            self.metrics.merge(sorter.metrics)
+            sorter.metrics.reset()
+
     def print_stats(self):
-        logging.info(f"Files found: {self.filesFound}")
-        logging.info(f"Files removed: {self.filesRemoved}")
-        logging.info(f"File duplicates: {self.fileDuplicates}")
-        logging.info(f"Files moved: {self.filesMoved}")
-        logging.info(f"Files renamed: {self.filesRenamed}")
-        logging.info(f"Files ignored: {self.filesIgnored}")
+        for path, stats in self.root_stats.items():
+            logging.log(SUMMARY, f"{path}: " + ", ".join(f"{value} {STAT_COUNTERS[name]}" for name, value in stats.items()))
+        logging.log(SUMMARY, f"Files found: {self.filesFound}")
+        logging.log(SUMMARY, f"Files removed: {self.filesRemoved}")
+        logging.log(SUMMARY, f"File duplicates: {self.fileDuplicates}")
+        logging.log(SUMMARY, f"Files linked: {self.filesLinked}")
+        logging.log(SUMMARY, f"Files moved: {self.filesMoved}")
+        logging.log(SUMMARY, f"Files renamed: {self.filesRenamed}")
+        logging.log(SUMMARY, f"Files ignored: {self.filesIgnored}")
+        if self.throttle is not None and self.throttle.waited:
+            logging.log(SUMMARY, f"Disk I/O was throttled for {self.throttle.waited:.1f} seconds")
+        if any(self.comparisons_decided.values()):
+            logging.log(SUMMARY, "File comparisons decided by " +
+                         ", ".join(f"{stage}: {count}" for stage, count in self.comparisons_decided.items()))
     
-    def start_sorting(self, *args) -> None:
-        """Starts sorting based on provided arguments."""
-        
-        os.chdir(self.config.get("DOWNLOAD_FOLDER_PATH"))
-        logging.info(f"Moved to {self.config.get("DOWNLOAD_FOLDER_PATH")} directory")
-        
-        self.calculate_workload(args)
-        self.clean_logs()
-        self.sort_files()
-        if 'rm_duplicates' in args:
-            logging.info("Removing duplicates")
-            self.remove_duplicates()
-            logging.info("All duplicates were removed!")
-        self.print_stats()
+    def write_metrics(self) -> None:
+        """Writes the metrics of the run as JSON and Prometheus textfile to METRICS_DIR."""
+        metrics_dir = self.config.get("METRICS_DIR", os.path.join(self.root_path, "metrics"))
+        if not metrics_dir:
+            return
+        gauges = {
+            "files_found": self.filesFound,
+            "files_removed": self.filesRemoved,
+            "file_duplicates": self.fileDuplicates,
+            "files_linked": self.filesLinked,
+            "files_moved": self.filesMoved,
+            "files_renamed": self.filesRenamed,
+            "files_ignored": self.filesIgnored
+        }
+        if self.hash_cache is not None:
+            gauges["hash_cache_hits"] = self.hash_cache.hits
+            gauges["hash_cache_misses"] = self.hash_cache.misses
+        if self.throttle is not None:
+            gauges["io_throttled_seconds"] = round(self.throttle.waited, 3)
+        try:
+            self.metrics.write(metrics_dir, gauges)
+        except OSError as e:
+            logging.error(f"Could not write metrics to {metrics_dir}: {e}")
+
+    def save_hash_cache(self, prune=False) -> None:
+        """Writes the hash cache to disk, optionally dropping entries of vanished files."""
+        if self.hash_cache is None:
+            return
+        if prune:
+            self.hash_cache.prune()
+        self.hash_cache.save()
+        logging.log(SUMMARY, f"Hash cache hits: {self.hash_cache.hits}, misses: {self.hash_cache.misses}")
+    
+    def start_sorting(self, *args, dry_run=False, cancel_token=None) -> Plan:
+        """Starts sorting based on provided arguments.
+        Operations are planned first and then executed in batches, with dry_run the plan is only returned.
+        Several download folders are sorted concurrently, their counters are merged into this sorter.
+        The run stops at the next file once cancel_token is cancelled.
+        """
+        paths = self.get_download_paths()
+        self.root_sorters = [self]
+        self.root_stats = {}
+        self.cancel_token = cancel_token or CancelToken()
+        self.metrics.reset()
+        if self.throttle is not None:
+            self.throttle.waited = 0.0
+        self.apply_io_priority()
+
+        plan = Plan()
+        try:
+            if not dry_run:
+                with self.metrics.phase("clean_logs"):
+                    self.clean_logs()
+            if len(paths) == 1:
+                plan = self.sort_root(args, dry_run=dry_run)
+            else:
+                plan = self.sort_roots(paths, args, dry_run=dry_run)
+            if dry_run:
+                logging.log(SUMMARY, f"Planned operations: {plan.counts()}")
+            else:
+                logging.log(SUMMARY, "All files were sorted!")
+        except SortCancelled:
+            logging.log(SUMMARY, "Sorting was cancelled")
+        finally:
+            self.shutdown_hash_workers()
+            self.save_hash_cache(prune='rm_duplicates' in args and not self.cancel_token.cancelled)
+            self.write_metrics()
+        if not dry_run:
+            self.print_stats()
+        self.current_task = "Cancelled" if self.cancel_token.cancelled else "Finished"
+        self.publish_progress(self.processed_files, self.total_files, self.processed_bytes, finished=True)
+        return plan
+
+    def sort_roots(self, paths, args, dry_run=False) -> Plan:
+        """ Sort several download folders concurrently, ROOT_WORKERS folders at a time
+            Returns the operations of all folders, e.g. for a dry run
+        """
+        self.current_task = "Sorting download folders"
+        # Started once for all root sorters, they get it from this sorter
+        self.get_hash_executor()
+        log_base = os.path.commonpath(paths)
+        self.root_sorters = [self.create_root_sorter(path, log_base) for path in paths]
+        plan = Plan()
+        with ThreadPoolExecutor(max_workers=self.config.get("ROOT_WORKERS", min(4, len(paths))),
+                                thread_name_prefix="root") as executor:
+            futures = [(sorter, executor.submit(sorter.sort_root, args, dry_run)) for sorter in self.root_sorters]
+            for sorter, future in futures:
+                try:
+                    plan.operations.extend(future.result())
+                except SortCancelled:
+                    continue
+                except OSError as e:
+                    logging.error(f"Could not sort {sorter.download_path}: {e}")
+        self.collect_root_stats()
+        self.cancel_token.check()
+        return plan
+
+    def sort_root(self, args, dry_run=False) -> Plan:
+        """ Sort the download folder of this sorter, an interrupted run recorded in its journal is finished first """
+        self.listings = {}
+        self.name_indexes = {}
+        self.content_index = None
+        self.planned_paths = {}
+        self.expiry_index = ExpiryIndex()
+
+        plan = Plan()
+        try:
+            interrupted = self.journal.load() if self.journal is not None else None
+            if interrupted is not None:
+                if dry_run:
+                    logging.warning("The journal contains an interrupted run, it is resumed by the next run without --dry-run")
+                else:
+                    self.resume_run(*interrupted)
+
+            with self.metrics.phase("workload"):
+                self.calculate_workload()
+                self.check_directories(create=not dry_run)
+            # Sorting is executed in batches while the download folder is scanned, the rest is executed at the end
+            with self.metrics.phase("sort"):
+                self.plan_sort(plan, batch=None if dry_run else self.execute_batch)
+            with self.metrics.phase("retention"):
+                self.plan_expire(plan)
+            if 'rm_duplicates' in args:
+                with self.metrics.phase("dedupe"):
+                    if self.config.get("DEDUPE_MODE", "directory") == "external":
+                        # The tree is scanned as it is on disk, so the planned operations are executed first
+                        if not dry_run:
+                            self.execute_batch(plan)
+                        self.plan_external_duplicates(plan, batch=None if dry_run else self.execute_batch)
+                    else:
+                        self.plan_duplicates(plan)
+            if not dry_run:
+                with self.metrics.phase("execute"):
+                    self.execute_batch(plan)
+        finally:
+            if self.journal is not None:
+                self.journal.close()
+        return plan
+    
+    def resume_run(self, plan, begun, done) -> None:
+        """ Finish the plan of an interrupted run recorded in the journal
+            Only operations that are not done are checked and executed, afterwards the run continues normally
+        """
+        logging.log(SUMMARY, f"{self.log_prefix}Resuming interrupted run, {len(done)} of {len(plan)} operations were done")
+        with self.metrics.phase("recover"):
+            completed = self.recover_operations(plan, begun, done)
+            self.journal.start(plan, resumed=True)
+            for index, path in completed.items():
+                if index not in done:
+                    self.journal.done(index, path)
+            self.execute_plan(plan, journal=self.journal, completed=completed)
+            self.journal.finish()
+        logging.log(SUMMARY, f"{self.log_prefix}Interrupted run was finished!")
+
+    def sort_file(self, file) -> None:
+        """ Sort a single file of one of the download folders, used by watch mode """
+        if self.log_files:
+            logging.debug(f"File {file} was found.")
+        self.get_root_sorter(file).check_file(file)
+
+    def watch(self, *args) -> None:
+        """ Sort the download folders once and then sort every new file as soon as its download finished
+            Runs until interrupted with Ctrl+C
+        """
+        self.start_sorting(*args)
+        watcher = FileWatcher(file_sorter=self, paths=[sorter.download_path for sorter in self.root_sorters],
+                              settle_time=self.config.get("WATCH_SETTLE_SECONDS", 0.5),
+                              ignore_suffixes=self.config.get("WATCH_IGNORE_SUFFIXES"))
+        self.current_task = "Watching download folder"
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            logging.log(SUMMARY, "Watch mode stopped")
+        finally:
+            self.collect_root_stats()
+            self.shutdown_hash_workers()
+            self.save_hash_cache()
+            self.write_metrics()
+            self.print_stats()
     
     # Getter methods for global counters
     def get_files_found(self) -> int:
@@ -286,6 +1853,9 @@ class FileSorter:
     def get_file_duplicates(self) -> int:
         return self.fileDuplicates
     
+    def get_files_linked(self) -> int:
+        return self.filesLinked
+    
     def get_files_moved(self) -> int:
         return self.filesMoved
     
@@ -305,21 +1875,29 @@ if __name__ == "__main__":
                 "FOLDERS" : { "FOLDER_NAME": ["FILE_SUFFIX_1","FILE_SUFFIX_2"], "FOLDER_NAME2": ["FILE_SUFFIX_1","FILE_SUFFIX_2"] }
             }
 
-    if not os.path.isdir("logs"):
-        os.mkdir("logs")
+    setup_logging(log_dir="logs")
 
-    logging.basicConfig(filename=f"./logs/OutputLog_{date.today().strftime("%d_%m_%Y")}.log", level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Sort the download folder")
+    parser.add_argument("command", nargs="?", choices=["rm_duplicates", "watch"],
+                        help="rm_duplicates: also remove duplicates, watch: keep sorting new files")
+    parser.add_argument("--jobs", type=int, help="Number of hash workers, overrides HASH_WORKERS")
+    parser.add_argument("--hash-mode", choices=["thread", "process"], help="Hash worker mode, overrides HASH_WORKER_MODE")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the planned operations as JSON without changing any file")
+    cli_args = parser.parse_args()
+    if cli_args.dry_run and cli_args.command == "watch":
+        parser.error("--dry-run can not be used in watch mode")
 
     file_sorter = FileSorter(config_layout=CONFIG_LAYOUT)
-    file_sorter.clean_logs()
-    file_sorter.sort_files()
-
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "rm_duplicates":
-            logging.info("Removing duplicates")
-            file_sorter.remove_duplicates()
-            logging.info("All duplicates were removed!")
+    if cli_args.jobs is not None:
+        file_sorter.hash_workers = cli_args.jobs
+    if cli_args.hash_mode is not None:
+        file_sorter.hash_worker_mode = cli_args.hash_mode
 
-        
-    file_sorter.print_stats()
\ No newline at end of file
+    if cli_args.command == "watch":
+        file_sorter.watch()
+    else:
+        args = [cli_args.command] if cli_args.command else []
+        plan = file_sorter.start_sorting(*args, dry_run=cli_args.dry_run)
+        if cli_args.dry_run:
+            print(plan.to_json())
@@ -0,0 +1,250 @@
+""" Benchmark for FileSorter on a generated download folder
+
+    python FileSortBench.py --files 10000 --size-dist lognormal:9:2 --duplicate-ratio 0.1 --output result.json
+
+Every run generates the same folder for the same parameters and seed. The time of each phase
+(workload count, sort, retention, dedupe, log cleanup) is reported as JSON with files/s and MB/s.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import date, timedelta
+
+DEFAULT_FOLDERS = {
+    "Documents": [".pdf", ".docx", ".txt", ".xlsx"],
+    "Images": [".png", ".jpg", ".jpeg", ".gif"],
+    "Videos": [".mp4", ".mkv"],
+    "Archives": [".zip", ".tar.gz", ".7z"],
+    "Programs": [".exe", ".msi", ".deb"]
+}
+MAX_FILE_SIZE = 1024 * 1024 * 1024
+
+def parse_size_distribution(spec: str):
+    """ Returns a function rng -> file size for "fixed:BYTES", "uniform:MIN:MAX" or "lognormal:MU:SIGMA" """
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: int(values[0])
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.randint(int(values[0]), int(values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: min(int(rng.lognormvariate(values[0], values[1])), MAX_FILE_SIZE)
+    raise argparse.ArgumentTypeError(f"Invalid size distribution {spec}")
+
+def generate_download_folder(path, files, size_dist, folders, duplicate_ratio=0.1, collision_ratio=0.05,
+                             unmatched_ratio=0.05, old_ratio=0.1, depth=0, seed=0) -> dict:
+    """ Creates a reproducible download folder below path and returns a summary of it
+        - duplicate_ratio: share of files that are copies of an earlier file under another name
+        - collision_ratio: share of files whose name already exists with other content in their destination folder
+        - unmatched_ratio: share of files without a configured suffix
+        - old_ratio: share of files with a modification time one year in the past
+        - depth: files are spread over subfolders up to this depth
+    """
+    rng = random.Random(seed)
+    suffixes = [(folder, suffix) for folder, folder_suffixes in folders.items() for suffix in folder_suffixes]
+    directories = [path]
+    for level in range(depth):
+        directories += [os.path.join(directories[-1], f"level{level}_{index}") for index in range(2)]
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    # Duplicates are drawn from the most recent files to keep memory bounded for large runs
+    contents = deque(maxlen=1000)
+    summary = {"files": 0, "bytes": 0, "duplicates": 0, "collisions": 0, "unmatched": 0, "old": 0}
+    old_time = time.time() - 365 * 24 * 3600
+    for index in range(files):
+        folder, suffix = rng.choice(suffixes)
+        if rng.random() < unmatched_ratio:
+            suffix = ".unmatched"
+            summary["unmatched"] += 1
+        name = f"file_{index}{suffix}"
+
+        if contents and rng.random() < duplicate_ratio:
+            content = rng.choice(contents)
+            summary["duplicates"] += 1
+        else:
+            content = rng.randbytes(size_dist(rng))
+            contents.append(content)
+
+        file_path = os.path.join(rng.choice(directories), name)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        if rng.random() < old_ratio:
+            os.utime(file_path, (old_time, old_time))
+            summary["old"] += 1
+
+        if suffix != ".unmatched" and rng.random() < collision_ratio:
+            os.makedirs(os.path.join(path, folder), exist_ok=True)
+            with open(os.path.join(path, folder, name), "wb") as f:
+                f.write(rng.randbytes(16) + content)
+            summary["collisions"] += 1
+
+        summary["files"] += 1
+        summary["bytes"] += len(content)
+    return summary
+
+def tree_size(path):
+    """ Returns (number of files, bytes) below path """
+    files = 0
+    size = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+def top_level_size(path):
+    """ Returns (number of files, bytes) directly in path, the files the sorter counts and sorts without RECURSIVE_SORT """
+    files = 0
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                files += 1
+                size += entry.stat().st_size
+    return files, size
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(args) -> dict:
+    folders = DEFAULT_FOLDERS
+    if args.config:
+        with open(args.config, "r") as f:
+            folders = json.load(f)["FOLDERS"]
+
+    work_dir = tempfile.mkdtemp(prefix="filesort_bench_", dir=args.work_dir)
+    download_path = os.path.join(work_dir, "downloads")
+    start_dir = os.getcwd()
+    try:
+        start = time.perf_counter()
+        summary = generate_download_folder(download_path, args.files, args.size_dist, folders,
+                                           duplicate_ratio=args.duplicate_ratio, collision_ratio=args.collision_ratio,
+                                           unmatched_ratio=args.unmatched_ratio, old_ratio=args.old_ratio,
+                                           depth=args.depth, seed=args.seed)
+        generate_seconds = time.perf_counter() - start
+
+        # Old logs for the log cleanup phase
+        os.makedirs(os.path.join(work_dir, "logs"))
+        for days in range(1, 31):
+            log_path = os.path.join(work_dir, "logs", f"OutputLog_{(date.today() - timedelta(days=days)).strftime('%d_%m_%Y')}.log")
+            with open(log_path, "w") as f:
+                f.write("benchmark\n")
+            log_time = time.time() - days * 24 * 3600
+            os.utime(log_path, (log_time, log_time))
+
+        config = {
+            "DOWNLOAD_FOLDER_PATH": download_path,
+            "ALLOW_DUPLICATES": False,
+            "DELETE_LOGS_AFTER_DAYS": 7,
+            "DELETE_FILES_AFTER_DAYS": 30,
+            "FOLDERS": folders,
+            "HASH_CACHE": args.hash_cache,
+            "LOG_VERBOSITY": args.log_verbosity
+        }
+        if args.jobs is not None:
+            config["HASH_WORKERS"] = args.jobs
+        with open(os.path.join(work_dir, "config.json"), "w") as f:
+            json.dump(config, f, indent=4)
+
+        # FileSorter reads config.json and writes its log relative to the working directory
+        os.chdir(work_dir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from FileSort import FileSorter
+        from FileSortLogging import setup_logging, shutdown_logging
+
+        setup_logging(log_dir=os.path.join(work_dir, "logs"), verbosity=args.log_verbosity)
+        sorter = FileSorter(config_layout={})
+        phases = {}
+
+        def run_phase(name, function, files, size):
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+            phases[name] = {
+                "seconds": round(seconds, 4),
+                "files": files,
+                "bytes": size,
+                "files_per_sec": round(files / seconds, 1) if seconds else None,
+                "mb_per_sec": round(size / seconds / (1024 * 1024), 1) if seconds else None
+            }
+
+        # The workload only lists the download folder itself, like the sort of a non-recursive configuration
+        run_phase("workload", sorter.calculate_workload, *top_level_size(download_path))
+        sorter.check_directories()
+        run_phase("sort", sorter.sort_files, *top_level_size(download_path))
+        run_phase("retention", sorter.remove_old_files, *tree_size(download_path))
+        run_phase("dedupe", sorter.remove_duplicates, *tree_size(download_path))
+        run_phase("log_cleanup", sorter.clean_logs, *tree_size(os.path.join(work_dir, "logs")))
+        sorter.shutdown_hash_workers()
+        sorter.save_hash_cache()
+        shutdown_logging()
+
+        return {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {
+                "files": args.files, "size_dist": args.size_dist_spec, "duplicate_ratio": args.duplicate_ratio,
+                "collision_ratio": args.collision_ratio, "unmatched_ratio": args.unmatched_ratio,
+                "old_ratio": args.old_ratio, "depth": args.depth, "seed": args.seed, "jobs": args.jobs,
+                "hash_cache": args.hash_cache, "log_verbosity": args.log_verbosity
+            },
+            "generated": dict(summary, seconds=round(generate_seconds, 4)),
+            "phases": phases,
+            "counters": {
+                "files_found": sorter.get_files_found(),
+                "files_removed": sorter.get_files_removed(),
+                "file_duplicates": sorter.get_file_duplicates(),
+                "files_linked": sorter.get_files_linked(),
+                "files_moved": sorter.get_files_moved(),
+                "files_renamed": sorter.get_files_renamed(),
+                "files_ignored": sorter.get_files_ignored()
+            }
+        }
+    finally:
+        os.chdir(start_dir)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FileSorter on a generated download folder")
+    parser.add_argument("--files", type=int, default=1000, help="Number of generated files")
+    parser.add_argument("--size-dist", default="lognormal:9:1.5",
+                        help="File size distribution in bytes: fixed:N, uniform:MIN:MAX or lognormal:MU:SIGMA")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--collision-ratio", type=float, default=0.05)
+    parser.add_argument("--unmatched-ratio", type=float, default=0.05)
+    parser.add_argument("--old-ratio", type=float, default=0.1, help="Share of files older than DELETE_FILES_AFTER_DAYS")
+    parser.add_argument("--depth", type=int, default=0, help="Nesting depth of subfolders")
+    parser.add_argument("--config", help="config.json to take FOLDERS from")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, help="HASH_WORKERS of the benchmarked sorter")
+    parser.add_argument("--hash-cache", action="store_true", help="Enable the hash cache (cold cache)")
+    parser.add_argument("--log-verbosity", choices=["summary", "action", "debug"], default="action",
+                        help="LOG_VERBOSITY of the benchmarked sorter")
+    parser.add_argument("--work-dir", help="Directory for the generated folder, default is the system temp directory")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated folder")
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    cli_args = parser.parse_args()
+    cli_args.size_dist_spec = cli_args.size_dist
+    cli_args.size_dist = parse_size_distribution(cli_args.size_dist)
+
+    result = json.dumps(run_benchmark(cli_args), indent=4)
+    if cli_args.output:
+        with open(cli_args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
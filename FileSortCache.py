@@ -0,0 +1,194 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Pending entries are written to disk in batches of this size
+COMMIT_INTERVAL = 1000
+
+class HashCache:
+    """ Persistent file hash cache stored in a SQLite database
+        Entries are keyed by (device, inode, algorithm) and are only valid while
+        size and mtime_ns of the file are unchanged.
+        The links table remembers files that were replaced by a reflink of another file, so they are known to be
+        identical to their origin without being hashed again. Both the reflink and its origin must be unchanged.
+    """
+    def __init__(self, db_path, max_entries=1_000_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pending_puts = {}
+        self.pending_touches = {}
+        self.pending_links = {}
+        self.hits = 0
+        self.misses = 0
+
+        # Other sorter instances may use the same database, wait for their writes instead of failing
+        self.connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                algorithm TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (dev, inode, algorithm)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(links)")]
+        if columns and "origin_mtime_ns" not in columns:
+            # Links of older versions do not know the state of their origin, they can not be trusted
+            self.connection.execute("DROP TABLE links")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS links (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                origin_dev INTEGER NOT NULL,
+                origin_inode INTEGER NOT NULL,
+                origin_size INTEGER NOT NULL,
+                origin_mtime_ns INTEGER NOT NULL,
+                origin_path TEXT NOT NULL,
+                PRIMARY KEY (dev, inode)
+            )""")
+        self.connection.commit()
+
+    def get(self, path, algorithm, stat=None):
+        """ Returns the cached digest of a file or None if there is no valid entry """
+        if stat is None:
+            stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, algorithm)
+        with self.lock:
+            pending = self.pending_puts.get(key)
+            if pending is not None:
+                row = (pending[3], pending[4], pending[6])
+            else:
+                row = self.connection.execute(
+                    "SELECT size, mtime_ns, digest FROM hashes WHERE dev = ? AND inode = ? AND algorithm = ?",
+                    key).fetchone()
+            if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.pending_touches[key] = (time.time(), path)
+            self._flush_if_full()
+            return row[2]
+
+    def put(self, path, algorithm, digest, stat=None) -> None:
+        """ Stores the digest of a file, replacing an outdated entry for the same inode """
+        if stat is None:
+            stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, algorithm)
+        with self.lock:
+            self.pending_puts[key] = (*key, stat.st_size, stat.st_mtime_ns, path, digest, time.time())
+            self._flush_if_full()
+
+    def get_origin(self, stat):
+        """ Returns the path and stat of the file a file was reflinked from
+            None if it was not, or if the file or its origin changed since, either may have been edited in place
+        """
+        key = (stat.st_dev, stat.st_ino)
+        with self.lock:
+            pending = self.pending_links.get(key)
+            if pending is not None:
+                row = (pending[2], pending[3], *pending[5:])
+            else:
+                row = self.connection.execute(
+                    "SELECT size, mtime_ns, origin_dev, origin_inode, origin_size, origin_mtime_ns, origin_path "
+                    "FROM links WHERE dev = ? AND inode = ?", key).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        try:
+            origin = os.stat(row[6])
+        except OSError:
+            return None
+        if (origin.st_dev, origin.st_ino, origin.st_size, origin.st_mtime_ns) != tuple(row[2:6]):
+            return None
+        return row[6], origin
+
+    def put_origin(self, path, origin_path, stat=None, origin_stat=None) -> None:
+        """ Remembers that a file is a reflink of the file at origin_path """
+        if stat is None:
+            stat = os.stat(path)
+        if origin_stat is None:
+            origin_stat = os.stat(origin_path)
+        key = (stat.st_dev, stat.st_ino)
+        with self.lock:
+            self.pending_links[key] = (*key, stat.st_size, stat.st_mtime_ns, path, origin_stat.st_dev, origin_stat.st_ino,
+                                       origin_stat.st_size, origin_stat.st_mtime_ns, origin_path)
+            self._flush_if_full()
+
+    def _flush_if_full(self) -> None:
+        if len(self.pending_puts) + len(self.pending_touches) + len(self.pending_links) >= COMMIT_INTERVAL:
+            self._flush()
+
+    def _flush(self) -> None:
+        """ Writes buffered entries in one short transaction, the caller holds the lock """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO hashes (dev, inode, algorithm, size, mtime_ns, path, digest, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending_puts.values())
+            self.connection.executemany(
+                "UPDATE hashes SET last_used = ?, path = ? WHERE dev = ? AND inode = ? AND algorithm = ?",
+                ((*touch, *key) for key, touch in self.pending_touches.items()))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO links (dev, inode, size, mtime_ns, path, origin_dev, origin_inode, origin_size, "
+                "origin_mtime_ns, origin_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending_links.values())
+        self.pending_puts.clear()
+        self.pending_touches.clear()
+        self.pending_links.clear()
+
+    def prune(self) -> int:
+        """ Removes entries of files that vanished or whose inode now belongs to another file """
+        pruned = 0
+        # Inodes are reused, an entry of one table being stale says nothing about the other table
+        for table in ("hashes", "links"):
+            with self.lock:
+                rows = self.connection.execute(f"SELECT DISTINCT dev, inode, path FROM {table}").fetchall()
+            stale = []
+            for dev, inode, path in rows:
+                try:
+                    stat = os.stat(path)
+                    if stat.st_dev != dev or stat.st_ino != inode:
+                        stale.append((dev, inode))
+                except OSError:
+                    stale.append((dev, inode))
+            with self.lock:
+                self.connection.executemany(f"DELETE FROM {table} WHERE dev = ? AND inode = ?", stale)
+                self.connection.commit()
+            pruned += len(stale)
+        logging.info(f"Hash cache pruned {pruned} stale files")
+        return pruned
+
+    def evict(self) -> int:
+        """ Removes the least recently used entries above max_entries """
+        with self.lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow <= 0:
+                return 0
+            self.connection.execute(
+                "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)",
+                (overflow,))
+            self.connection.commit()
+        logging.info(f"Hash cache evicted {overflow} least recently used entries")
+        return overflow
+
+    def save(self) -> None:
+        """ Writes pending entries and enforces the maximum cache size """
+        with self.lock:
+            self._flush()
+        self.evict()
+
+    def close(self) -> None:
+        self.save()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,132 @@
+import errno
+import os
+import shutil
+from typing import NamedTuple
+
+from FileSortHash import HASH_CHUNK_SIZE, PARTIAL_HASH_SIZE, hash_file, new_hash
+
+# Errors of copy_file_range and sendfile when they can not copy between the two files
+ZERO_COPY_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+# Largest count passed to a single copy_file_range or sendfile call
+ZERO_COPY_CHUNK = 1024 * 1024 * 1024
+
+class CopyResult(NamedTuple):
+    """ Hashes of a copied file, as hash_file and hash_file_partial would return them
+        Both are None when the file was copied without passing through userspace and was not verified
+    """
+    digest: str = None
+    partial_digest: str = None
+
+def write_all(fd, data) -> None:
+    """ os.write may write less than asked for, e.g. when interrupted by a signal """
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+def fsync_directory(path) -> None:
+    """ Sync the entries of a directory, not possible on every platform """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def copy_hashed(source_fd, target_fd, algorithm, buffer_size, throttle=None) -> CopyResult:
+    """ Copy a file with one large buffer and hash it in the same pass
+        The partial hash is built from the first and last PARTIAL_HASH_SIZE bytes seen while copying
+    """
+    file_hash = new_hash(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    head = b""
+    tail = b""
+    size = 0
+    with open(source_fd, "rb", buffering=0, closefd=False) as source:
+        while length := (throttle.readinto(source, buffer) if throttle is not None else source.readinto(buffer)):
+            chunk = view[:length]
+            file_hash.update(chunk)
+            write_all(target_fd, chunk)
+            if len(head) < PARTIAL_HASH_SIZE:
+                head += chunk[:PARTIAL_HASH_SIZE - len(head)]
+            tail = bytes(chunk[-PARTIAL_HASH_SIZE:]) if length >= PARTIAL_HASH_SIZE else (tail + chunk)[-PARTIAL_HASH_SIZE:]
+            size += length
+    digest = file_hash.hexdigest()
+    if size <= 2 * PARTIAL_HASH_SIZE:
+        # Small files are hashed completely by hash_file_partial as well
+        return CopyResult(digest, digest)
+    partial_hash = new_hash(algorithm)
+    partial_hash.update(head)
+    partial_hash.update(tail)
+    return CopyResult(digest, partial_hash.hexdigest())
+
+def copy_zero(source_fd, target_fd, size, throttle=None, chunk_size=ZERO_COPY_CHUNK) -> bool:
+    """ Copy a file in the kernel with copy_file_range or sendfile, chunk_size bytes at a time
+        Returns False if neither is supported for these files before anything was copied
+    """
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                count = min(size - offset, chunk_size)
+                if throttle is not None:
+                    throttle.acquire(count, ops=0)
+                if method == "copy_file_range":
+                    copied = os.copy_file_range(source_fd, target_fd, count, offset, offset)
+                else:
+                    # Writes at the position of target_fd, which advances with every call
+                    copied = os.sendfile(target_fd, source_fd, offset, count)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError as e:
+            if offset or e.errno not in ZERO_COPY_UNSUPPORTED:
+                raise
+            continue
+        if offset < size:
+            raise OSError(errno.EIO, f"Source became shorter while being copied ({offset} of {size} bytes)")
+        return True
+    return False
+
+def transfer_file(source, target, algorithm="sha256", method="hash", buffer_size=HASH_CHUNK_SIZE, verify=False,
+                  throttle=None) -> CopyResult:
+    """ Copy source over target with its permissions and times and sync target to disk
+        method "hash" copies through a buffer of buffer_size bytes and returns the hashes of the content,
+        "zero_copy" lets the kernel copy the data and only hashes when verify is set.
+        With verify target is read again from disk and compared with the hash of source, a mismatch raises OSError.
+        The caller removes source afterwards, so it is only removed once target is safely on disk.
+        With throttle (an IOThrottle) the copy is paced, zero copies then move buffer_size bytes per call.
+    """
+    if throttle is not None:
+        throttle.acquire()
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        target_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            result = CopyResult()
+            size = os.fstat(source_fd).st_size
+            chunk_size = ZERO_COPY_CHUNK if throttle is None else buffer_size
+            if method != "zero_copy" or not copy_zero(source_fd, target_fd, size, throttle, chunk_size):
+                result = copy_hashed(source_fd, target_fd, algorithm, buffer_size, throttle)
+            shutil.copystat(source, target)
+            os.fsync(target_fd)
+            if verify and hasattr(os, "posix_fadvise"):
+                # Drop the cached pages so the verification reads what is on disk
+                os.posix_fadvise(target_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(target_fd)
+    finally:
+        os.close(source_fd)
+    fsync_directory(os.path.dirname(os.path.abspath(target)))
+    if verify:
+        if result.digest is None:
+            result = result._replace(digest=hash_file(source, algorithm, throttle))
+        if hash_file(target, algorithm, throttle) != result.digest:
+            raise OSError(errno.EIO, f"Copy of {source} does not match the source", target)
+    return result
@@ -0,0 +1,161 @@
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import sys
+from typing import NamedTuple
+
+# Read buffer of every run file that is merged, fan-in * MERGE_BUFFER bytes are used while merging
+MERGE_BUFFER = 1024 * 1024
+# Size of the list holding a line in memory on top of the string itself
+LINE_OVERHEAD = 8
+# Format of the run files, manifests of other versions are not resumed
+MANIFEST_VERSION = 2
+
+class Record(NamedTuple):
+    """ A file of an external duplicate search, records are sorted by size, digest and path
+        digest is empty until the file was hashed, mtime_ns is the one of the scan
+    """
+    size: int
+    digest: str
+    path: str
+    dev: int
+    inode: int
+    mtime_ns: int
+
+def encode_record(record) -> str:
+    """ Returns a record as a line whose text order is the order of the records
+        Sizes are zero-padded and the path is JSON, so it never contains a tab or newline
+    """
+    return (f"{record.size:020d}\t{record.digest}\t{json.dumps(record.path)}\t{record.dev}\t{record.inode}"
+            f"\t{record.mtime_ns}\n")
+
+def decode_record(line) -> Record:
+    size, digest, path, dev, inode, mtime_ns = line.rstrip("\n").split("\t")
+    return Record(int(size), digest, json.loads(path), int(dev), int(inode), int(mtime_ns))
+
+def iter_shared(records, key):
+    """ Yields the records whose key is shared with another record, records have to be sorted by key
+        Only two records of a group are held at a time
+    """
+    for _, group in itertools.groupby(records, key):
+        first = next(group)
+        second = next(group, None)
+        if second is None:
+            continue
+        yield first
+        yield second
+        yield from group
+
+def iter_runs(paths):
+    """ Yields the records of sorted run files in order """
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(path, "r", encoding="ascii", newline="\n", buffering=MERGE_BUFFER))
+                 for path in paths]
+        for line in heapq.merge(*files):
+            yield decode_record(line)
+
+class RunWriter:
+    """ Writes records as sorted run files of at most memory bytes each """
+    def __init__(self, directory, prefix, memory):
+        self.directory = directory
+        self.prefix = prefix
+        self.memory = memory
+        self.lines = []
+        self.used = 0
+        self.count = 0
+        self.runs = []
+
+    def add(self, record) -> None:
+        line = encode_record(record)
+        self.lines.append(line)
+        self.used += sys.getsizeof(line) + LINE_OVERHEAD
+        self.count += 1
+        if self.used >= self.memory:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.lines:
+            return
+        self.lines.sort()
+        path = os.path.join(self.directory, f"{self.prefix}_{len(self.runs):06d}.run")
+        with open(path, "w", encoding="ascii", newline="\n") as f:
+            f.writelines(self.lines)
+        self.runs.append(path)
+        self.lines = []
+        self.used = 0
+
+    def close(self) -> list:
+        """ Writes the remaining records and returns the paths of all runs """
+        self.flush()
+        return self.runs
+
+def merge_pass(paths, directory, prefix, fan_in) -> list:
+    """ Merges every fan_in runs into one and returns the new runs
+        The input runs are kept, they are removed with remove_runs once the new runs are saved in the manifest
+    """
+    merged = []
+    for start in range(0, len(paths), fan_in):
+        group = paths[start:start + fan_in]
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        path = os.path.join(directory, f"{prefix}_{len(merged):06d}.run")
+        with open(path, "w", encoding="ascii", newline="\n") as f:
+            f.writelines(encode_record(record) for record in iter_runs(group))
+        merged.append(path)
+    return merged
+
+def remove_runs(paths, keep=()) -> None:
+    for path in paths:
+        if path not in keep:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+class Manifest:
+    """ Progress of an external duplicate search of one download folder, saved after every stage
+        stage is the index of the last stage whose runs were written, runs and records describe them.
+        An interrupted search continues with the runs of its manifest instead of scanning again.
+    """
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.stage = None
+        self.runs = []
+        self.records = 0
+        self.merges = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION and data.get("root") == root and all(os.path.exists(run) for run in data["runs"]):
+            self.stage = data["stage"]
+            self.runs = data["runs"]
+            self.records = data["records"]
+            self.merges = data.get("merges", 0)
+
+    def save(self, stage, runs, records, merges=0) -> None:
+        self.stage, self.runs, self.records, self.merges = stage, runs, records, merges
+        data = {"version": MANIFEST_VERSION, "root": self.root, "stage": stage, "runs": runs, "records": records, "merges": merges}
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def remove_stray_runs(self) -> None:
+        """ Removes run files of an interrupted stage that are not part of the manifest """
+        directory = os.path.dirname(self.path)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".run") and path not in self.runs:
+                os.remove(path)
+
+    def remove(self) -> None:
+        """ Removes the manifest and its runs once the search finished """
+        remove_runs(self.runs)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
@@ -1,13 +1,26 @@
 import os
 import json
+import queue
+import logging
 import tkinter as tk
+import tkinter.font as tk_font
 from tkinter import messagebox, simpledialog, ttk
 import tkinter.filedialog as tk_filedialog
 import threading
 from FileSort import FileSorter
+from FileSortLogging import SUMMARY, setup_logging
+from FileSortLogView import LogIndex
+from FileSortProgress import CancelToken, latest_events
 
 DISABLED_NUMBER = -1
 MAX_DAYS = float("inf")
+# Progress events are coalesced and shown at this interval in milliseconds
+PROGRESS_INTERVAL = 100
+# The log viewer redraws at this interval in milliseconds, the log is checked for new lines every LOG_FOLLOW_SECONDS
+LOG_REFRESH_INTERVAL = 250
+LOG_FOLLOW_SECONDS = 0.5
+LOG_LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "SUMMARY": SUMMARY, "WARNING": logging.WARNING,
+              "ERROR": logging.ERROR}
 CONFIG_PATH = os.path.join(os.getcwd(), "config.json")
 DEFAULT_CONFIG = {
     "DOWNLOAD_FOLDER_PATH": "path/to/downloadfolder",
@@ -28,6 +41,10 @@ class FileSorterApp:
         self.load_config()
 
         self.file_sorter = FileSorter(config_layout=self.config)
+        self.progress_queue = queue.SimpleQueue()
+        self.file_sorter.progress_queue = self.progress_queue
+        self.sorter_thread = None
+        self.console_stats = None
         
         # UI Layout
         self.create_widgets()
@@ -275,22 +292,28 @@ class FileSorterApp:
         with open(CONFIG_PATH, "w") as f:
             json.dump(self.config, f, indent=4)
         messagebox.showinfo(title="Saved", message="config.json has been saved.")
-        self.file_sorter.load_config(self.config)
+        self.file_sorter.reload_config(self.config)
         self.refresh_config_display()
     
     def start_filesorter(self):
+        if self.sorter_thread is not None and self.sorter_thread.is_alive():
+            messagebox.showwarning(title="Running", message="FileSorter is already running.")
+            return
         # Build args based on GUI options
         args = []
         if self.rm_duplicates_var.get():
             args.append("rm_duplicates")
-        # Run sorting in a separate thread so GUI remains responsive
+        # Run sorting in a separate thread so GUI remains responsive, it reports through the progress queue
+        cancel_token = CancelToken()
+        latest_events(self.progress_queue)
         def run_sorter():
-            self.file_sorter.start_sorting(*args)
+            self.file_sorter.start_sorting(*args, cancel_token=cancel_token)
         
-        threading.Thread(target=run_sorter, daemon=True).start()
-        self.start_sorter_progress_widget()
+        self.sorter_thread = threading.Thread(target=run_sorter, daemon=True)
+        self.sorter_thread.start()
+        self.start_sorter_progress_widget(cancel_token)
         
-    def start_sorter_progress_widget(self):
+    def start_sorter_progress_widget(self, cancel_token):
         
         widget = tk.Toplevel(self.root)
         widget.title("FileSorter Progress")
@@ -303,45 +326,75 @@ class FileSorterApp:
         percent_label = tk.Label(widget, text="0%", font=("Arial", 12))
         percent_label.pack(pady=5)
         
-        cancel_button = tk.Button(widget, text="Cancel", command=widget.destroy)
+        def cancel():
+            if self.sorter_thread.is_alive():
+                cancel_token.cancel()
+                cancel_button.config(text="Cancelling...", state="disabled")
+            else:
+                widget.destroy()
+        
+        cancel_button = tk.Button(widget, text="Cancel", command=cancel)
         cancel_button.pack(pady=10)
+        widget.protocol("WM_DELETE_WINDOW", cancel)
         
         status_label = tk.Label(widget, text="Starting...", font=("Arial", 10))
         status_label.pack(pady=5)
         
-        
-        def update_progress(progress_bar=progress_bar, percent_label=percent_label, status_label=status_label):
-            progress = self.file_sorter.get_progress_percent()
-            progress_bar["value"] = progress
-            percent_label.config(text=f"{progress}%")
-            status_label.config(text=self.file_sorter.get_current_task())
-            if progress < 100:
-                widget.after(50, update_progress)
-            else:
-                progress_bar["value"] = 100
-                percent_label.config(text="100%")
-                status_label.config(text="Sorting complete.")
+        file_label = tk.Label(widget, text="", font=("Arial", 9), width=60, anchor="w")
+        file_label.pack(padx=10, pady=5)
+        
+        # Latest event of every download folder
+        events = {}
+        
+        def update_progress():
+            if not widget.winfo_exists():
+                return
+            events.update(latest_events(self.progress_queue))
+            finished = [event for event in events.values() if event.finished]
+            if finished:
+                if finished[0].task == "Finished":
+                    progress_bar["value"] = 100
+                    percent_label.config(text="100%")
+                    status_label.config(text="Sorting complete.")
+                else:
+                    status_label.config(text="Sorting cancelled.")
+                file_label.config(text="")
+                cancel_button.config(text="Close", state="normal")
+                return
+            if events:
+                done = sum(event.done for event in events.values())
+                total = sum(event.total for event in events.values())
+                size = sum(event.size for event in events.values())
+                progress = min(100, int(done / total * 100)) if total else 0
+                progress_bar["value"] = progress
+                percent_label.config(text=f"{progress}% ({done}/{total}, {size / (1024 * 1024):.1f} MB)")
+                status_label.config(text=", ".join(sorted({event.task for event in events.values()})))
+                files = [event.file for event in events.values() if event.file]
+                if files:
+                    file_label.config(text=os.path.basename(files[-1]))
+            widget.after(PROGRESS_INTERVAL, update_progress)
 
-        # Start periodic progress updates on the main thread
-        widget.after(50, update_progress)
-        
-        widget.mainloop()
+        # Events are taken from the queue on the main thread, at most every PROGRESS_INTERVAL ms
+        widget.after(PROGRESS_INTERVAL, update_progress)
     
     def refresh_console(self):
-        # Refresh the console every second with FileSorter stats and progress
+        # Refresh the console every second with FileSorter stats and progress, the text is only replaced when it changed
         stats = (
             f"Files Found: {self.file_sorter.get_files_found()}\n"
             f"Files Removed: {self.file_sorter.get_files_removed()}\n"
             f"File Duplicates: {self.file_sorter.get_file_duplicates()}\n"
+            f"Files Linked: {self.file_sorter.get_files_linked()}\n"
             f"Files Moved: {self.file_sorter.get_files_moved()}\n"
             f"Files Renamed: {self.file_sorter.get_files_renamed()}\n"
             f"Files Ignored: {self.file_sorter.get_files_ignored()}\n"
             f"Progress: {self.file_sorter.get_progress_bar()}\n"
         )
-        self.console_text.config(state="normal")
-        self.console_text.delete("1.0", tk.END)
-        self.console_text.insert(tk.END, stats)
-        self.console_text.config(state="disabled")
+        if stats != self.console_stats:
+            self.console_stats = stats
+            self.console_text.config(state="normal")
+            self.console_text.delete("1.0", tk.END)
+            self.console_text.insert(tk.END, stats)
+            self.console_text.config(state="disabled")
         self.root.after(1000, self.refresh_console)
     
     def view_logs(self):
@@ -355,21 +408,7 @@ class FileSorterApp:
             return
         # Get the most recent log file
         log_files.sort(key=lambda f: os.path.getmtime(os.path.join(logs_dir, f)), reverse=True)
-        latest_log = os.path.join(logs_dir, log_files[0])
-        try:
-            with open(latest_log, "r") as f:
-                content = f.read()
-        except Exception as e:
-            messagebox.showerror(title="Error", message=f"Failed to read log file: {str(e)}")
-            return
-        
-        # Create a new window to display the log content
-        log_win = tk.Toplevel(self.root)
-        log_win.title("Log Viewer - " + os.path.basename(latest_log))
-        text_widget = tk.Text(log_win, wrap="word")
-        text_widget.insert(tk.END, content)
-        text_widget.config(state="disabled")
-        text_widget.pack(fill="both", expand=True)
+        LogViewer(self.root, os.path.join(logs_dir, log_files[0]))
 
     def on_folder_select(self, event):
         # Placeholder for selection event if needed
@@ -390,7 +429,152 @@ class FileSorterApp:
         else:
             raise ValueError(f"Invalid config key: {var_name}")
 
+class LogViewer:
+    """ Window showing a log file page by page, only the lines on screen are read from the file
+        The line index is built by a background thread, which keeps following the file while the window is open.
+    """
+    def __init__(self, root, path):
+        self.index = LogIndex(path)
+        self.first = 0
+        self.rows = 40
+        self.rendered = None
+        # Line of the last search result and its text, "Find Next" continues after it
+        self.last_match = None
+        self.last_search = None
+        self.stop = threading.Event()
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Log Viewer - " + os.path.basename(path))
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        toolbar = tk.Frame(self.window)
+        toolbar.pack(fill="x", padx=5, pady=5)
+        tk.Label(toolbar, text="Level").pack(side="left")
+        self.level_var = tk.StringVar(value="DEBUG")
+        level_box = ttk.Combobox(toolbar, textvariable=self.level_var, values=list(LOG_LEVELS), state="readonly", width=10)
+        level_box.bind("<<ComboboxSelected>>", self.on_level_change)
+        level_box.pack(side="left", padx=5)
+        self.follow_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(toolbar, text="Follow", variable=self.follow_var).pack(side="left", padx=5)
+        self.search_var = tk.StringVar()
+        search_entry = tk.Entry(toolbar, textvariable=self.search_var, width=30)
+        search_entry.bind("<Return>", lambda event: self.find_next())
+        search_entry.pack(side="left", padx=5)
+        tk.Button(toolbar, text="Find Next", command=self.find_next).pack(side="left")
+        self.status_label = tk.Label(toolbar, text="Indexing...")
+        self.status_label.pack(side="right")
+
+        text_frame = tk.Frame(self.window)
+        text_frame.pack(fill="both", expand=True)
+        self.scrollbar = tk.Scrollbar(text_frame, orient="vertical", command=self.on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.text = tk.Text(text_frame, wrap="none", height=self.rows, width=120)
+        self.text.pack(side="left", fill="both", expand=True)
+        self.text.tag_config("match", background="yellow")
+        self.text.config(state="disabled")
+        self.text.bind("<Configure>", self.on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.text.bind(sequence, self.on_wheel)
+        self.window.bind("<Prior>", lambda event: self.on_scroll("scroll", -1, "pages"))
+        self.window.bind("<Next>", lambda event: self.on_scroll("scroll", 1, "pages"))
+
+        threading.Thread(target=self.index_file, daemon=True).start()
+        self.window.after(LOG_REFRESH_INTERVAL, self.refresh)
+
+    def index_file(self) -> None:
+        while not self.stop.is_set():
+            try:
+                self.index.update()
+            except OSError:
+                # The log was removed, e.g. by DELETE_LOGS_AFTER_DAYS
+                pass
+            self.stop.wait(LOG_FOLLOW_SECONDS)
+
+    def close(self) -> None:
+        self.stop.set()
+        self.window.destroy()
+
+    def refresh(self) -> None:
+        if self.stop.is_set():
+            return
+        if self.follow_var.get():
+            self.first = max(0, self.index.line_count() - self.rows)
+        self.render()
+        self.window.after(LOG_REFRESH_INTERVAL, self.refresh)
+
+    def render(self, match=None) -> None:
+        """ Show the lines from self.first on, nothing is read when they did not change """
+        count = self.index.line_count()
+        state = (self.first, self.rows, count if count < self.first + self.rows else None, self.index.generation, match)
+        if state == self.rendered:
+            return
+        self.rendered = state
+        lines = self.index.read_lines(self.first, self.rows)
+        self.text.config(state="normal")
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(lines))
+        if match is not None:
+            self.text.tag_add("match", f"{match - self.first + 1}.0", f"{match - self.first + 1}.end")
+        self.text.config(state="disabled")
+        if count:
+            self.scrollbar.set(self.first / count, (self.first + len(lines)) / count)
+            self.status_label.config(text=f"Lines {self.first + 1}-{self.first + len(lines)} of {count}")
+        else:
+            self.scrollbar.set(0, 1)
+            self.status_label.config(text="No lines")
+
+    def on_scroll(self, action, amount, unit=None) -> None:
+        count = self.index.line_count()
+        if action == "moveto":
+            self.first = int(float(amount) * count)
+        else:
+            self.first += int(amount) * (self.rows if unit == "pages" else 1)
+        self.first = max(0, min(self.first, count - self.rows))
+        # Scrolling to the end follows the log again, scrolling up stops following
+        self.follow_var.set(self.first >= count - self.rows)
+        self.render()
+
+    def on_wheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.on_scroll("scroll", -3, "units")
+        else:
+            self.on_scroll("scroll", 3, "units")
+        # The text widget only holds the visible lines and must not scroll itself
+        return "break"
+
+    def on_resize(self, event) -> None:
+        line_height = tk_font.nametofont(self.text.cget("font")).metrics("linespace")
+        self.rows = max(1, event.height // line_height)
+        self.render()
+
+    def on_level_change(self, event) -> None:
+        self.first = 0
+        self.last_match = None
+        # Filtering a large log takes a moment, the index shows the new lines once it is done
+        threading.Thread(target=self.index.set_min_level, args=(LOG_LEVELS[self.level_var.get()],), daemon=True).start()
+
+    def find_next(self) -> None:
+        """ Jump to the next line containing the search text, starting again at the top after the last line
+            A new search text is searched from the first line on screen
+        """
+        text = self.search_var.get()
+        if not text:
+            return
+        start = self.last_match + 1 if self.last_match is not None and text == self.last_search else self.first
+        line = self.index.search(text, start)
+        if line is None and start > 0:
+            line = self.index.search(text, 0)
+        self.last_match = line
+        self.last_search = text
+        if line is None:
+            self.status_label.config(text=f"{text} not found")
+            return
+        self.follow_var.set(False)
+        self.first = max(0, min(line - 2, self.index.line_count() - self.rows))
+        self.render(match=line)
+
 if __name__ == "__main__":
+    setup_logging(log_dir="logs")
     root = tk.Tk()
     # Set window geometry
     root.geometry(newGeometry="1200x1200")
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import time
+
+# Bytes read from the start and the end of a file for the cheap duplicate pre-check
+PARTIAL_HASH_SIZE = 4 * 1024
+# Read size used while hashing whole files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Algorithms tried by HASH_ALGORITHM "auto", fastest first on most 64 bit CPUs
+AUTO_CANDIDATES = ["blake2b", "blake2s", "sha1", "md5", "sha256"]
+BENCHMARK_SIZE = 4 * 1024 * 1024
+
+def new_hash(algorithm="sha256"):
+    """Create a hash object for an algorithm name.
+    blake2b and blake2s accept a digest size in bytes, e.g. "blake2b:16".
+    """
+    name, _, digest_size = algorithm.partition(":")
+    if digest_size:
+        if name not in ("blake2b", "blake2s"):
+            raise ValueError(f"Only blake2b and blake2s support a digest size, got {algorithm}")
+        return getattr(hashlib, name)(digest_size=int(digest_size))
+    return hashlib.new(name)
+
+def partial_hash_tag(algorithm) -> str:
+    """Name under which partial hashes are stored, they must never be compared with full hashes."""
+    return f"{algorithm}-partial{PARTIAL_HASH_SIZE}"
+
+def hash_file(file_path, algorithm="sha256", throttle=None) -> str:
+    """Calculate the hash of a whole file, runs in the hash worker pool.
+    Reads are paced by throttle (an IOThrottle) if given.
+    """
+    with open(file=file_path, mode='rb') as f:
+        file_hash = new_hash(algorithm)
+        if throttle is not None:
+            throttle.acquire()
+            while chunk := throttle.read(f.read, HASH_CHUNK_SIZE):
+                file_hash.update(chunk)
+            return file_hash.hexdigest()
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+def hash_file_partial(file_path, size, algorithm="sha256", throttle=None) -> str:
+    """Calculate the hash of the first and last PARTIAL_HASH_SIZE bytes of a file.
+    Files up to 2 * PARTIAL_HASH_SIZE are hashed completely.
+    """
+    if throttle is not None:
+        throttle.acquire(min(size, 2 * PARTIAL_HASH_SIZE))
+    with open(file=file_path, mode='rb') as f:
+        file_hash = new_hash(algorithm)
+        if size <= 2 * PARTIAL_HASH_SIZE:
+            file_hash.update(f.read())
+        else:
+            file_hash.update(f.read(PARTIAL_HASH_SIZE))
+            f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            file_hash.update(f.read(PARTIAL_HASH_SIZE))
+        return file_hash.hexdigest()
+
+def benchmark_hash_algorithms(candidates=AUTO_CANDIDATES, size=BENCHMARK_SIZE, rounds=3) -> dict:
+    """Returns the throughput in MB/s of every available candidate algorithm."""
+    data = os.urandom(size)
+    results = {}
+    for algorithm in candidates:
+        try:
+            new_hash(algorithm)
+        except ValueError:
+            # Not available, e.g. md5 on FIPS systems
+            continue
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            new_hash(algorithm).update(data)
+            best = min(best, time.perf_counter() - start)
+        results[algorithm] = round(size / best / (1024 * 1024), 1)
+    return results
+
+def select_hash_algorithm(cache_path) -> str:
+    """Returns the fastest hash algorithm of this host.
+    The benchmark result is stored in cache_path and reused as long as host and Python version match.
+    """
+    host = f"{platform.node()}|{platform.machine()}|{platform.python_version()}|{hashlib.__file__}"
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached.get("host") == host:
+            return cached["algorithm"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    results = benchmark_hash_algorithms()
+    algorithm = max(results, key=results.get)
+    logging.info(f"Hash benchmark (MB/s): {results}, using {algorithm}")
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"host": host, "algorithm": algorithm, "results": results}, f, indent=4)
+    except OSError as e:
+        logging.warning(f"Could not save hash benchmark to {cache_path}: {e}")
+    return algorithm
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+
+from FileSortPlan import Plan
+
+class Journal:
+    """ Append-only journal of the plan executed by a run, one JSON record per line
+        - plan: all operations of the run, written and synced before the first operation is executed
+        - begin: destination of a copy to another file system, synced before the copy starts
+        - done: an operation was completed, with the path a moved file ended up at
+        - end: the run finished, the journal is removed afterwards
+        Records are synced in batches of sync_interval, an unfinished journal lets the next run resume the plan.
+    """
+    def __init__(self, path, sync_interval=1000):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.file = None
+        self.unsynced = 0
+
+    def load(self):
+        """ Returns (plan, begun, done) of an unfinished run or None
+            begun and done map operation indexes to paths
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+
+        plan = None
+        begun = {}
+        done = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last record may be incomplete after a crash
+                logging.warning(f"Ignoring damaged record in journal {self.path}")
+                continue
+            if record["type"] == "plan":
+                plan = Plan.from_dict(record)
+            elif record["type"] == "begin":
+                begun[record["index"]] = record["path"]
+            elif record["type"] == "done":
+                done[record["index"]] = record.get("path")
+            elif record["type"] == "end":
+                return None
+        if plan is None:
+            return None
+        return plan, begun, done
+
+    def write(self, record) -> None:
+        self.file.write(json.dumps(record) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        if self.file is None or not self.unsynced:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def start(self, plan, resumed=False) -> None:
+        """ Starts journaling a plan, a resumed plan is appended to its existing journal """
+        self.file = open(self.path, "a" if resumed else "w", encoding="utf-8")
+        if not resumed:
+            self.write(dict(plan.to_dict(), type="plan"))
+        elif self.file.tell() and not self.ends_with_newline():
+            # Terminate a record that was cut off by the crash
+            self.file.write("\n")
+        self.sync()
+
+    def ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def begin(self, index, path) -> None:
+        self.write({"type": "begin", "index": index, "path": path})
+
+    def done(self, index, path=None) -> None:
+        self.write({"type": "done", "index": index, "path": path})
+
+    def finish(self) -> None:
+        """ Marks the run as finished and removes the journal """
+        self.write({"type": "end"})
+        self.close()
+        os.remove(self.path)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
@@ -0,0 +1,158 @@
+import bisect
+import logging
+import mmap
+import os
+import threading
+from array import array
+
+from FileSortLogging import SUMMARY
+
+# Lines start with "%(asctime)s - %(levelname)s - ", the level name follows the timestamp
+LEVEL_OFFSET = len("2024-01-01 00:00:00,000 - ")
+# Levels by the first letter of their name
+LEVEL_BY_INITIAL = {
+    ord("D"): logging.DEBUG,
+    ord("I"): logging.INFO,
+    ord("S"): SUMMARY,
+    ord("W"): logging.WARNING,
+    ord("E"): logging.ERROR,
+    ord("C"): logging.CRITICAL
+}
+READ_SIZE = 1024 * 1024
+
+class LogIndex:
+    """ Offsets and levels of the lines of a log file, the file itself is never loaded as a whole
+        update() indexes lines appended since its last call and may run in a background thread,
+        lines are read on demand with pread and search runs on a memory map of the file.
+        Lines without a level, e.g. the rest of a multi-line message, get the level of the line before.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.min_level = logging.NOTSET
+        # Changes whenever lines may be shown at other positions than before
+        self.generation = 0
+        self.reset()
+
+    def reset(self) -> None:
+        # Start of every line, the last offset is the end of the last complete line
+        self.offsets = array("Q", [0])
+        self.levels = bytearray()
+        # Lines of at least min_level, None while every line is shown
+        self.visible = None if self.min_level <= logging.DEBUG else array("Q")
+        self.last_level = logging.INFO
+        self.generation += 1
+
+    @property
+    def indexed(self) -> int:
+        return self.offsets[-1]
+
+    def line_count(self) -> int:
+        with self.lock:
+            return len(self.levels) if self.visible is None else len(self.visible)
+
+    def update(self) -> int:
+        """ Index the complete lines appended since the last call, returns the number of new lines
+            A file that became smaller was replaced and is indexed again from the start
+        """
+        new_lines = 0
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.indexed:
+                with self.lock:
+                    self.reset()
+            position = self.indexed
+            read_size = READ_SIZE
+            while position < size:
+                chunk = os.pread(f.fileno(), read_size, position)
+                end = chunk.rfind(b"\n")
+                if end < 0:
+                    if len(chunk) < read_size:
+                        # The last line is still being written
+                        break
+                    read_size *= 2
+                    continue
+                new_lines += self.index_chunk(chunk, end + 1, position)
+                position += end + 1
+                read_size = READ_SIZE
+        return new_lines
+
+    def index_chunk(self, chunk, length, position) -> int:
+        """ Index the lines of chunk[:length] which starts at position in the file """
+        offsets = array("Q")
+        levels = bytearray()
+        level = self.last_level
+        start = 0
+        while start < length:
+            newline = chunk.find(b"\n", start, length)
+            if chunk[start + LEVEL_OFFSET - 3:start + LEVEL_OFFSET] == b" - ":
+                level = LEVEL_BY_INITIAL.get(chunk[start + LEVEL_OFFSET], level)
+            levels.append(level)
+            start = newline + 1
+            offsets.append(position + start)
+        with self.lock:
+            first = len(self.levels)
+            self.offsets.extend(offsets)
+            self.levels.extend(levels)
+            if self.visible is not None:
+                self.visible.extend(first + line for line, level in enumerate(levels) if level >= self.min_level)
+            self.last_level = level
+        return len(levels)
+
+    def set_min_level(self, min_level) -> None:
+        """ Only show lines of at least min_level """
+        with self.lock:
+            self.min_level = min_level
+            self.generation += 1
+            if min_level <= logging.DEBUG:
+                self.visible = None
+            else:
+                self.visible = array("Q", (line for line, level in enumerate(self.levels) if level >= min_level))
+
+    def read_lines(self, first, count) -> list:
+        """ Returns count shown lines starting with the shown line first """
+        with self.lock:
+            if self.visible is None:
+                lines = range(first, min(first + count, len(self.levels)))
+            else:
+                lines = self.visible[first:first + count]
+            ranges = [(self.offsets[line], self.offsets[line + 1]) for line in lines]
+        if not ranges:
+            return []
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if self.visible is None:
+                # Consecutive lines are read at once
+                data = os.pread(fd, ranges[-1][1] - ranges[0][0], ranges[0][0])
+                return data.decode("utf-8", "replace").split("\n")[:-1]
+            return [os.pread(fd, end - start, start).decode("utf-8", "replace").rstrip("\n") for start, end in ranges]
+        finally:
+            os.close(fd)
+
+    def search(self, text, first=0):
+        """ Returns the first shown line from first on that contains text (case-sensitive), None if there is none """
+        needle = text.encode("utf-8")
+        with self.lock:
+            if self.visible is None:
+                line = first
+            elif first < len(self.visible):
+                line = self.visible[first]
+            else:
+                return None
+            if not needle or line >= len(self.levels):
+                return None
+            start = self.offsets[line]
+            end = self.indexed
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            while True:
+                found = mapped.find(needle, start, end)
+                if found < 0:
+                    return None
+                with self.lock:
+                    line = bisect.bisect_right(self.offsets, found) - 1
+                    if self.visible is None:
+                        return line
+                    position = bisect.bisect_left(self.visible, line)
+                    if position < len(self.visible) and self.visible[position] == line:
+                        return position
+                    start = self.offsets[line + 1]
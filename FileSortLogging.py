@@ -0,0 +1,112 @@
+import atexit
+import logging
+import os
+import queue
+import time
+from datetime import date
+from logging.handlers import QueueHandler, QueueListener
+
+# Level of run summaries and progress lines, logged in every verbosity
+SUMMARY = 25
+logging.addLevelName(SUMMARY, "SUMMARY")
+
+# LOG_VERBOSITY values and the root logger level they set
+VERBOSITY_LEVELS = {
+    "summary": SUMMARY,     # Progress, statistics, warnings and errors
+    "action": logging.INFO, # Additionally every move, rename and removal
+    "debug": logging.DEBUG  # Additionally every file that was looked at
+}
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_BUFFER_SIZE = 64 * 1024
+
+listener = None
+queue_handler = None
+
+class BufferedFileHandler(logging.FileHandler):
+    """ FileHandler which writes through a large buffer and flushes at most every flush_interval seconds
+        Warnings and errors are flushed immediately. Records written since the last flush are pending until
+        the next record or FlushingQueueListener flushes them.
+    """
+    def __init__(self, filename, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.pending = False
+        super().__init__(filename, encoding="utf-8", delay=True)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=LOG_BUFFER_SIZE, encoding=self.encoding)
+
+    def flush(self) -> None:
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.force_flush()
+
+    def force_flush(self) -> None:
+        super().flush()
+        self.last_flush = time.monotonic()
+        self.pending = False
+
+    def emit(self, record) -> None:
+        self.pending = True
+        super().emit(record)
+        if record.levelno >= logging.WARNING:
+            self.force_flush()
+
+    def close(self) -> None:
+        self.force_flush()
+        super().close()
+
+class FlushingQueueListener(QueueListener):
+    """ QueueListener which flushes pending records of its handlers once their flush interval passed,
+        also when no further record arrives, e.g. while watch mode waits for new downloads
+    """
+    def dequeue(self, block):
+        while True:
+            pending = [handler for handler in self.handlers if getattr(handler, "pending", False)]
+            if not pending:
+                return self.queue.get(block)
+            due = min(handler.last_flush + handler.flush_interval for handler in pending)
+            try:
+                return self.queue.get(block, timeout=max(0.0, due - time.monotonic()))
+            except queue.Empty:
+                for handler in pending:
+                    handler.flush()
+
+def setup_logging(log_dir="logs", verbosity="action", flush_interval=1.0) -> QueueListener:
+    """ Log to log_dir/OutputLog_DD_MM_YYYY.log through a queue
+        Logging calls only put the record into the queue, formatting and writing happen in the listener thread.
+    """
+    global listener, queue_handler
+    if listener is not None:
+        return listener
+    os.makedirs(log_dir, exist_ok=True)
+    handler = BufferedFileHandler(os.path.join(log_dir, f"OutputLog_{date.today().strftime('%d_%m_%Y')}.log"),
+                                  flush_interval=flush_interval)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    logging.getLogger().addHandler(queue_handler)
+    set_verbosity(verbosity)
+
+    listener = FlushingQueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(shutdown_logging)
+    return listener
+
+def set_verbosity(verbosity) -> None:
+    if verbosity not in VERBOSITY_LEVELS:
+        logging.warning(f"Invalid LOG_VERBOSITY {verbosity}, using action")
+        verbosity = "action"
+    logging.getLogger().setLevel(VERBOSITY_LEVELS[verbosity])
+
+def shutdown_logging() -> None:
+    """ Write all queued records and close the log file """
+    global listener, queue_handler
+    if listener is None:
+        return
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    listener = None
+    queue_handler = None
@@ -0,0 +1,178 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value) -> None:
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def merge(self, other) -> None:
+        self.count += other.count
+        self.sum += other.sum
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+
+    def cumulative_counts(self) -> list:
+        """ Bucket counts as Prometheus expects them, every bucket includes all smaller ones """
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "buckets": {str(bound): count for bound, count in zip(self.buckets, self.cumulative_counts())}}
+
+class Metrics:
+    """ Phase timings, counters and latency histograms of a FileSorter run
+        Hooks added with add_hook are called as hook(kind, name, value) for every recorded value,
+        kind is "phase", "count" or "observe".
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def reset(self) -> None:
+        """ Clears all values of the previous run, hooks stay registered """
+        with self.lock:
+            self.started = time.time()
+            self.phases = {}
+            self.counters = defaultdict(int)
+            self.histograms = defaultdict(Histogram)
+
+    def merge(self, other) -> None:
+        """ Adds the values of another Metrics, e.g. of a download folder that was sorted concurrently
+            Phases of concurrent runs overlap, so the longest one is kept instead of adding them
+        """
+        with other.lock:
+            phases = dict(other.phases)
+            counters = dict(other.counters)
+            histograms = dict(other.histograms)
+        with self.lock:
+            for name, phase in phases.items():
+                if name not in self.phases or phase["wall_seconds"] > self.phases[name]["wall_seconds"]:
+                    self.phases[name] = phase
+            for name, value in counters.items():
+                self.counters[name] += value
+            for name, histogram in histograms.items():
+                self.histograms[name].merge(histogram)
+
+    def add_hook(self, hook) -> None:
+        self.hooks.append(hook)
+
+    def notify(self, kind, name, value) -> None:
+        for hook in self.hooks:
+            hook(kind, name, value)
+
+    def count(self, name, value=1) -> None:
+        with self.lock:
+            self.counters[name] += value
+        if self.hooks:
+            self.notify("count", name, value)
+
+    def observe(self, name, seconds) -> None:
+        with self.lock:
+            self.histograms[name].observe(seconds)
+        if self.hooks:
+            self.notify("observe", name, seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """ Measures wall time and CPU time of the process for a phase """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            phase = {"wall_seconds": round(time.perf_counter() - wall_start, 6),
+                     "cpu_seconds": round(time.process_time() - cpu_start, 6)}
+            with self.lock:
+                self.phases[name] = phase
+            if self.hooks:
+                self.notify("phase", name, phase)
+
+    def to_dict(self, gauges=None) -> dict:
+        with self.lock:
+            return {
+                "started": self.started,
+                "finished": time.time(),
+                "phases": dict(self.phases),
+                "counters": dict(self.counters),
+                "gauges": dict(gauges or {}),
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+            }
+
+    def to_prometheus(self, gauges=None) -> str:
+        """ Returns the metrics in the Prometheus text format, e.g. for the node exporter textfile collector """
+        data = self.to_dict(gauges)
+        lines = [
+            "# HELP filesort_phase_wall_seconds Wall time of a phase of the last run.",
+            "# TYPE filesort_phase_wall_seconds gauge"
+        ]
+        lines += [f'filesort_phase_wall_seconds{{phase="{name}"}} {phase["wall_seconds"]}' for name, phase in data["phases"].items()]
+        lines += [
+            "# HELP filesort_phase_cpu_seconds CPU time of the process during a phase of the last run.",
+            "# TYPE filesort_phase_cpu_seconds gauge"
+        ]
+        lines += [f'filesort_phase_cpu_seconds{{phase="{name}"}} {phase["cpu_seconds"]}' for name, phase in data["phases"].items()]
+        for name, value in sorted(data["counters"].items()):
+            lines += [f"# TYPE filesort_{name}_total counter", f"filesort_{name}_total {value}"]
+        for name, value in sorted(data["gauges"].items()):
+            lines += [f"# TYPE filesort_{name} gauge", f"filesort_{name} {value}"]
+        with self.lock:
+            histograms = list(self.histograms.items())
+        for name, histogram in histograms:
+            lines.append(f"# TYPE filesort_{name}_seconds histogram")
+            for bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                lines.append(f'filesort_{name}_seconds_bucket{{le="{bound}"}} {count}')
+            lines.append(f'filesort_{name}_seconds_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"filesort_{name}_seconds_sum {round(histogram.sum, 6)}")
+            lines.append(f"filesort_{name}_seconds_count {histogram.count}")
+        lines += ["# TYPE filesort_last_run_timestamp_seconds gauge", f"filesort_last_run_timestamp_seconds {round(data['finished'], 3)}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory, gauges=None) -> None:
+        """ Writes filesort_metrics.json and filesort.prom, files are replaced atomically so scrapers never see partial files """
+        os.makedirs(directory, exist_ok=True)
+        outputs = {
+            "filesort_metrics.json": json.dumps(self.to_dict(gauges), indent=4),
+            "filesort.prom": self.to_prometheus(gauges)
+        }
+        for name, content in outputs.items():
+            path = os.path.join(directory, name)
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+
+def timed(name):
+    """ Decorator for FileSorter methods, records the latency of every call in the histogram name """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,135 @@
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import shutil
+from collections import Counter
+from typing import NamedTuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# renameat2 constants from <fcntl.h> and <linux/fs.h>
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+# ioctl from <linux/fs.h> that shares the extents of a file with another file (btrfs, XFS, ...)
+FICLONE = 0x40049409
+# Errors of FICLONE when the file system can not share extents between the files
+CLONE_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS, errno.EPERM}
+
+# Actions of an operation, moves are executed first, removals afterwards
+MOVE_ACTIONS = ("move", "rename")
+REMOVE_ACTIONS = ("expire", "delete_duplicate")
+# Duplicates replaced by a link to their original, executed together with the removals
+LINK_ACTIONS = ("hardlink_duplicate", "reflink_duplicate")
+
+class Operation(NamedTuple):
+    """ A single change of the file system planned by FileSorter
+        - move: source is moved to target under its own name
+        - rename: source is moved to target under a new name because its name was taken
+        - expire: source is removed because it is older than DELETE_FILES_AFTER_DAYS
+        - delete_duplicate: source is removed because it has the same content as original
+        - hardlink_duplicate: source is replaced by a hard link to original
+        - reflink_duplicate: source is replaced by a copy of original sharing its extents, or a hard link
+        Paths are absolute and refer to the state after all earlier operations of the plan.
+    """
+    action: str
+    source: str
+    target: str = None
+    size: int = 0
+    original: str = None
+
+class Plan:
+    """ Ordered list of operations, can be written as JSON and read again """
+    def __init__(self, operations=None):
+        self.operations: list = list(operations or [])
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def add(self, operation: Operation) -> None:
+        self.operations.append(operation)
+
+    def counts(self) -> dict:
+        return dict(Counter(operation.action for operation in self.operations))
+
+    def to_dict(self) -> dict:
+        return {"counts": self.counts(), "operations": [operation._asdict() for operation in self.operations]}
+
+    def to_json(self, indent=4) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(Operation(**operation) for operation in data["operations"])
+
+libc = None
+renameat2_supported = True
+
+def rename_noreplace(source, target) -> None:
+    """ Rename source to target in a single syscall, raises FileExistsError instead of replacing target
+        Raises NotImplementedError when renameat2 or RENAME_NOREPLACE is not available (non-Linux, old kernels,
+        some file systems), callers then have to reserve target themselves.
+    """
+    global libc, renameat2_supported
+    if not renameat2_supported:
+        raise NotImplementedError("renameat2 is not available")
+    if libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "renameat2"):
+            renameat2_supported = False
+            raise NotImplementedError("renameat2 is not available")
+    if libc.renameat2(AT_FDCWD, os.fsencode(source), AT_FDCWD, os.fsencode(target), RENAME_NOREPLACE) == 0:
+        return
+    error = ctypes.get_errno()
+    if error in (errno.ENOSYS, errno.EINVAL):
+        renameat2_supported = False
+        raise NotImplementedError("renameat2 with RENAME_NOREPLACE is not supported")
+    raise OSError(error, os.strerror(error), source, None, target)
+
+def clone_file(source, target) -> None:
+    """ Create target as a reflink of source with the FICLONE ioctl, no data is copied
+        Raises NotImplementedError when the file system (or platform) can not clone the file, target is not left behind
+    """
+    if fcntl is None:
+        raise NotImplementedError("FICLONE is not available")
+    with open(source, "rb") as src, open(target, "xb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError as e:
+            error = e
+    os.remove(target)
+    if error.errno in CLONE_UNSUPPORTED:
+        raise NotImplementedError(f"FICLONE is not supported: {error}")
+    raise error
+
+def replace_with_link(path, original, reflink=False) -> str:
+    """ Atomically replace path by a link to original, the link is created under a temporary name and renamed over path
+        A reflink keeps the permissions and times of path, a hard link shares them with original.
+        Returns the kind of link that was created, "hardlink" when a reflink is not supported.
+    """
+    folder, name = os.path.split(path)
+    temporary = os.path.join(folder, f".{name}.{os.getpid()}.link")
+    kind = "reflink" if reflink else "hardlink"
+    try:
+        if reflink:
+            try:
+                clone_file(original, temporary)
+                shutil.copystat(path, temporary)
+            except NotImplementedError:
+                kind = "hardlink"
+        if kind == "hardlink":
+            os.link(original, temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        raise
+    return kind
@@ -0,0 +1,49 @@
+import queue
+import threading
+from typing import NamedTuple
+
+class SortCancelled(Exception):
+    """ Raised by FileSorter at the next file boundary after its CancelToken was cancelled """
+
+class CancelToken:
+    """ Cooperative cancellation of a FileSorter run, cancel() may be called from any thread
+        The sorter checks the token between files, so a file is never left half moved or half hashed.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self) -> None:
+        self.event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def check(self) -> None:
+        if self.event.is_set():
+            raise SortCancelled()
+
+class ProgressEvent(NamedTuple):
+    """ Progress of a task of a FileSorter run, published on its progress queue
+        done and total count files, or operations while a plan is executed, size is the number of bytes done.
+        The last event of a run has finished set and task "Finished" or "Cancelled".
+    """
+    root: str
+    task: str
+    done: int
+    total: int
+    size: int = 0
+    file: str = None
+    finished: bool = False
+
+def latest_events(progress_queue) -> dict:
+    """ Takes all events from the queue and returns the latest one of every download folder
+        Used to update a display at its own rate however fast events are published.
+    """
+    events = {}
+    while True:
+        try:
+            event = progress_queue.get_nowait()
+        except queue.Empty:
+            return events
+        events[event.root] = event
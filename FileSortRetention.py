@@ -0,0 +1,48 @@
+import heapq
+from datetime import date, datetime, time, timedelta
+
+def expiry_time(mtime, days) -> float:
+    """ Timestamp at which a file modified at mtime becomes older than days
+        Files expire at midnight, a file from Monday with days=1 expires on Wednesday 00:00
+    """
+    return datetime.combine(date.fromtimestamp(mtime) + timedelta(days=days + 1), time.min).timestamp()
+
+class ExpiryIndex:
+    """ Min-heap of expiry times, removing all due paths costs O(expired * log n)
+        Paths that are discarded or updated stay in the heap until they reach the top or the heap is compacted.
+    """
+    def __init__(self):
+        self.heap = []
+        self.expiry = {}
+
+    def __len__(self) -> int:
+        return len(self.expiry)
+
+    def add(self, path, expires) -> None:
+        self.expiry[path] = expires
+        heapq.heappush(self.heap, (expires, path))
+        if len(self.heap) > 2 * len(self.expiry) + 1024:
+            self.compact()
+
+    def discard(self, path) -> None:
+        self.expiry.pop(path, None)
+
+    def compact(self) -> None:
+        self.heap = [(expires, path) for path, expires in self.expiry.items()]
+        heapq.heapify(self.heap)
+
+    def next_expiry(self):
+        """ Returns the earliest expiry time or None if the index is empty """
+        while self.heap and self.expiry.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def pop_expired(self, now) -> list:
+        """ Removes and returns all paths that expired at now """
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expires, path = heapq.heappop(self.heap)
+            if self.expiry.get(path) == expires:
+                del self.expiry[path]
+                expired.append(path)
+        return expired
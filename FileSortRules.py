@@ -0,0 +1,88 @@
+import fnmatch
+import logging
+import re
+
+class RuleMatcher:
+    """ FOLDERS and FOLDER_RULES compiled into lookup tables
+        - Suffixes starting with "." are looked up by the parts of the filename starting at a dot
+        - Other suffixes are looked up by their length
+        - Glob and regex rules are combined into one regex per folder
+        - min_size/max_size limit a folder to files of a certain size in bytes
+        When several folders match, the one listed first in FOLDERS wins.
+    """
+    def __init__(self, folders: dict, folder_rules: dict = None, case_sensitive: bool = False):
+        self.folders = list(folders)
+        self.case_sensitive = case_sensitive
+        self.dot_suffixes = {}
+        self.other_suffixes = {}
+        self.patterns = []
+        self.size_limits = {}
+
+        for index, folder in enumerate(self.folders):
+            for suffix in folders[folder]:
+                suffix = self.normalize(suffix)
+                table = self.dot_suffixes if suffix.startswith(".") else self.other_suffixes
+                # Keep the first folder for suffixes configured more than once
+                table.setdefault(suffix, index)
+        self.other_suffix_lengths = sorted({len(suffix) for suffix in self.other_suffixes})
+        # Only the last few dots of a filename can start a configured suffix
+        self.max_suffix_dots = max((suffix.count(".") for suffix in self.dot_suffixes), default=0)
+
+        for folder, rules in (folder_rules or {}).items():
+            if folder not in folders:
+                logging.warning(f"FOLDER_RULES contains {folder} which is not in FOLDERS, rules were ignored")
+                continue
+            index = self.folders.index(folder)
+            # Globs have to match the whole name, regex rules may match anywhere in the name
+            expressions = ["^" + fnmatch.translate(pattern) for pattern in rules.get("glob", [])]
+            expressions += [f"(?:{expression})" for expression in rules.get("regex", [])]
+            if expressions:
+                flags = 0 if case_sensitive else re.IGNORECASE
+                self.patterns.append((index, re.compile("|".join(expressions), flags)))
+            if "min_size" in rules or "max_size" in rules:
+                self.size_limits[index] = (rules.get("min_size", 0), rules.get("max_size", float("inf")))
+
+        self.needs_size = bool(self.size_limits)
+        self.simple = self.max_suffix_dots <= 1 and not self.other_suffixes and not self.patterns and not self.needs_size
+
+    def normalize(self, name: str) -> str:
+        return name if self.case_sensitive else name.lower()
+
+    def match(self, filename: str, size: int = None):
+        """ Returns the folder for a filename or None if no rule matches
+            size is required when needs_size is set, otherwise folders with size limits never match
+        """
+        name = self.normalize(filename)
+
+        # Fast path for the common case of plain extensions without further rules
+        if self.simple:
+            dot = name.rfind(".")
+            index = self.dot_suffixes.get(name[dot:]) if dot != -1 else None
+            return None if index is None else self.folders[index]
+
+        candidates = []
+        dot = len(name)
+        for _ in range(self.max_suffix_dots):
+            dot = name.rfind(".", 0, dot)
+            if dot == -1:
+                break
+            index = self.dot_suffixes.get(name[dot:])
+            if index is not None:
+                candidates.append(index)
+
+        for length in self.other_suffix_lengths:
+            index = self.other_suffixes.get(name[-length:] if length else "")
+            if index is not None:
+                candidates.append(index)
+
+        for index, pattern in self.patterns:
+            if pattern.search(filename):
+                candidates.append(index)
+
+        for index in sorted(candidates):
+            if index in self.size_limits:
+                min_size, max_size = self.size_limits[index]
+                if size is None or not min_size <= size <= max_size:
+                    continue
+            return self.folders[index]
+        return None
@@ -0,0 +1,113 @@
+import os
+
+# Bytes read from the start of a file, tar archives are only recognized at offset 257
+SNIFF_SIZE = 512
+
+# (offset, magic bytes, suffix), checked in order, the first match wins
+SIGNATURES = [
+    (0, b"%PDF-", ".pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"GIF87a", ".gif"),
+    (0, b"GIF89a", ".gif"),
+    (0, b"II*\x00", ".tif"),
+    (0, b"MM\x00*", ".tif"),
+    (0, b"\x1aE\xdf\xa3", ".mkv"),
+    (0, b"ID3", ".mp3"),
+    (0, b"fLaC", ".flac"),
+    (0, b"OggS", ".ogg"),
+    (0, b"\x7fELF", ".elf"),
+    (0, b"MZ", ".exe"),
+    (0, b"\x1f\x8b", ".gz"),
+    (0, b"BZh", ".bz2"),
+    (0, b"\xfd7zXZ\x00", ".xz"),
+    (0, b"\x28\xb5\x2f\xfd", ".zst"),
+    (0, b"7z\xbc\xaf\x27\x1c", ".7z"),
+    (0, b"Rar!\x1a\x07", ".rar"),
+    (0, b"!<arch>\ndebian", ".deb"),
+    (0, b"\xed\xab\xee\xdb", ".rpm"),
+    (0, b"SQLite format 3\x00", ".sqlite"),
+    (0, b"{\\rtf", ".rtf"),
+    (0, b"%!PS", ".ps"),
+    (257, b"ustar", ".tar")
+]
+
+# RIFF containers by their form type at offset 8
+RIFF_TYPES = {b"WEBP": ".webp", b"WAVE": ".wav", b"AVI ": ".avi"}
+# ISO base media files by their major brand at offset 8, other brands are MP4
+FTYP_BRANDS = {b"qt  ": ".mov", b"M4A ": ".m4a", b"M4V ": ".m4v", b"heic": ".heic", b"heix": ".heic", b"mif1": ".heif",
+               b"avif": ".avif", b"3gp4": ".3gp", b"3gp5": ".3gp", b"3g2a": ".3g2"}
+# ZIP based formats by the name of an entry in the first local file header or the mimetype file
+ZIP_CONTENTS = [
+    (b"mimetypeapplication/epub+zip", ".epub"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.text", ".odt"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.spreadsheet", ".ods"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.presentation", ".odp"),
+    (b"word/", ".docx"),
+    (b"xl/", ".xlsx"),
+    (b"ppt/", ".pptx"),
+    (b"META-INF/", ".jar"),
+    (b"AndroidManifest.xml", ".apk")
+]
+
+def read_header(path):
+    """ Returns the first SNIFF_SIZE bytes of a file, None if it can not be read """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.pread(fd, SNIFF_SIZE, 0)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+def sniff_header(header):
+    """ Returns the suffix of the format the header belongs to, None if it is not known """
+    if header.startswith(b"PK\x03\x04"):
+        for content, suffix in ZIP_CONTENTS:
+            if content in header:
+                return suffix
+        return ".zip"
+    if header.startswith(b"RIFF"):
+        return RIFF_TYPES.get(header[8:12])
+    if header[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(header[8:12], ".mp4")
+    for offset, magic, suffix in SIGNATURES:
+        if header.startswith(magic, offset):
+            return suffix
+    start = header.lstrip()[:15].lower()
+    if start.startswith((b"<!doctype html", b"<html")):
+        return ".html"
+    return None
+
+class ContentSniffer:
+    """ Guesses the format of files without a matching suffix from their first bytes
+        Results are memoized by (inode, size, mtime), so unchanged files are only read once per process.
+    """
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self.memo = {}
+
+    def sniff(self, entries, executor=None) -> dict:
+        """ Returns {path: suffix or None} for a list of FileEntry, headers are read on executor if given """
+        suffixes = {}
+        missing = []
+        for entry in entries:
+            key = (entry.inode, entry.size, entry.mtime)
+            if key in self.memo:
+                suffixes[entry.path] = self.memo[key]
+            else:
+                missing.append(entry)
+
+        paths = [entry.path for entry in missing]
+        headers = executor.map(read_header, paths) if executor is not None and len(paths) > 1 else map(read_header, paths)
+        if len(self.memo) + len(missing) > self.max_entries:
+            self.memo.clear()
+        for entry, header in zip(missing, headers):
+            if header is None:
+                suffixes[entry.path] = None
+                continue
+            suffixes[entry.path] = self.memo[(entry.inode, entry.size, entry.mtime)] = sniff_header(header)
+        return suffixes
@@ -0,0 +1,207 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import threading
+import time
+from datetime import datetime
+
+# ioprio_set from <linux/ioprio.h>, the syscall number depends on the architecture
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {"realtime": 1, "best_effort": 2, "idle": 3}
+IOPRIO_SYSCALLS = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289, "aarch64": 30, "arm64": 30,
+                   "riscv64": 30, "armv7l": 314, "ppc64le": 273, "ppc64": 273, "s390x": 282}
+
+# Extra delay before every operation while the read latency is above IO_LATENCY_TARGET_MS
+MIN_BACKOFF = 0.001
+MAX_BACKOFF = 1.0
+# Weight of the newest latency in the moving average
+LATENCY_WEIGHT = 0.2
+# Seconds between two checks of IO_SCHEDULE
+SCHEDULE_CHECK_INTERVAL = 30
+
+def set_io_priority(priority) -> bool:
+    """ Lower the I/O priority of the calling thread, threads started afterwards inherit it
+        priority is "normal", "idle", "best_effort[:level]", "realtime[:level]" (ioprio_set, Linux only)
+        or "nice:n", which lowers the CPU priority and with it the I/O priority of the default class.
+        Returns False if the priority could not be set.
+    """
+    name, _, level = priority.partition(":")
+    if name == "normal":
+        return True
+    if name == "nice":
+        try:
+            os.nice(int(level or 10))
+            return True
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Could not set IO_PRIORITY {priority}: {e}")
+            return False
+    number = IOPRIO_SYSCALLS.get(platform.machine().lower())
+    if platform.system() != "Linux" or number is None:
+        logging.warning(f"IO_PRIORITY {priority} is only supported on Linux")
+        return False
+    value = (IOPRIO_CLASSES[name] << IOPRIO_CLASS_SHIFT) | (int(level or 7) if name != "idle" else 0)
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, value) != 0:
+        error = ctypes.get_errno()
+        logging.warning(f"Could not set IO_PRIORITY {priority}: {os.strerror(error)}")
+        return False
+    return True
+
+def validate_io_priority(priority) -> bool:
+    name, _, level = priority.partition(":")
+    if name == "normal":
+        return not level
+    if name == "nice":
+        return not level or level.lstrip("-").isdigit()
+    return name in IOPRIO_CLASSES and (not level or (level.isdigit() and int(level) <= 7 and name != "idle"))
+
+class TokenBucket:
+    """ Limits a rate to rate units per second with bursts of up to one second
+        Larger requests are allowed and put the bucket into debt, so the average rate holds for any request size.
+        A rate of 0 means no limit.
+    """
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate) -> None:
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount) -> float:
+        """ Takes amount tokens and returns the seconds to wait until they would have been available """
+        if amount <= 0:
+            return 0.0
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            self.refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+class Window:
+    """ A time of day with its own limits, start after end spans midnight
+        weekdays (0 is Monday) limits the window to some days, the day the window started counts
+    """
+    def __init__(self, start, end, bytes_per_second=0, ops_per_second=0, weekdays=None):
+        self.start = self.parse_time(start)
+        self.end = self.parse_time(end)
+        self.bytes_per_second = bytes_per_second
+        self.ops_per_second = ops_per_second
+        self.weekdays = set(weekdays) if weekdays is not None else None
+
+    @staticmethod
+    def parse_time(value) -> int:
+        hours, minutes = value.split(":")
+        return int(hours) * 60 + int(minutes)
+
+    def contains(self, now) -> bool:
+        minute = now.hour * 60 + now.minute
+        weekday = now.weekday()
+        if self.start <= self.end:
+            inside = self.start <= minute < self.end
+        else:
+            inside = minute >= self.start or minute < self.end
+            if inside and minute < self.end:
+                # Started the day before
+                weekday = (weekday - 1) % 7
+        return inside and (self.weekdays is None or weekday in self.weekdays)
+
+class IOThrottle:
+    """ Paces the reads and file operations of a FileSorter run
+        Bytes and operations are limited by token buckets whose rates come from the first matching
+        window of the schedule, or the default rates outside of all windows. When a latency target is set,
+        reads slower than the target add a delay before every read and operation that doubles while they stay slow
+        and halves once they are fast again.
+    """
+    def __init__(self, bytes_per_second=0, ops_per_second=0, schedule=(), latency_target=0.0):
+        self.default_rates = (bytes_per_second, ops_per_second)
+        self.schedule = list(schedule)
+        self.latency_target = latency_target
+        self.bytes = TokenBucket(bytes_per_second)
+        self.ops = TokenBucket(ops_per_second)
+        self.lock = threading.Lock()
+        self.latency = None
+        self.delay = 0.0
+        self.waited = 0.0
+        self.window = None
+        self.checked = 0.0
+        self.update_rates()
+
+    def update_rates(self) -> None:
+        """ Apply the rates of the window the current time is in """
+        now = datetime.now()
+        window = next((window for window in self.schedule if window.contains(now)), None)
+        if window is self.window and self.checked:
+            return
+        self.window = window
+        rates = (window.bytes_per_second, window.ops_per_second) if window is not None else self.default_rates
+        self.bytes.set_rate(rates[0])
+        self.ops.set_rate(rates[1])
+        if self.checked:
+            logging.info(f"I/O limits changed to {rates[0]} bytes/s and {rates[1]} operations/s")
+
+    def acquire(self, size=0, ops=1) -> None:
+        """ Wait until size bytes may be read or written and ops file operations started """
+        now = time.monotonic()
+        if now - self.checked >= SCHEDULE_CHECK_INTERVAL:
+            with self.lock:
+                self.update_rates()
+                self.checked = now
+        wait = max(self.bytes.reserve(size), self.ops.reserve(ops)) + self.delay
+        if wait > 0:
+            with self.lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    def observe(self, seconds) -> None:
+        """ Adapt the backoff delay to the latency of a read """
+        if not self.latency_target:
+            return
+        with self.lock:
+            self.latency = seconds if self.latency is None else \
+                (1 - LATENCY_WEIGHT) * self.latency + LATENCY_WEIGHT * seconds
+            if self.latency > self.latency_target:
+                self.delay = min(MAX_BACKOFF, max(MIN_BACKOFF, self.delay * 2))
+            elif self.delay:
+                self.delay = self.delay / 2 if self.delay > MIN_BACKOFF else 0.0
+
+    def read(self, read, size):
+        """ Call read(size), e.g. f.read, observe its latency and wait for the bytes that were read
+            Paying afterwards keeps short reads at the end of a file from being charged the whole size
+        """
+        start = time.monotonic()
+        data = read(size)
+        self.observe(time.monotonic() - start)
+        self.acquire(len(data), ops=0)
+        return data
+
+    def readinto(self, f, buffer) -> int:
+        """ Like read for f.readinto(buffer) """
+        start = time.monotonic()
+        length = f.readinto(buffer)
+        self.observe(time.monotonic() - start)
+        self.acquire(length or 0, ops=0)
+        return length
+
+def create_throttle(config):
+    """ Returns an IOThrottle for the IO_* settings of a config, None if none of them limits anything """
+    bytes_per_second = config.get("IO_BYTES_PER_SECOND", 0)
+    ops_per_second = config.get("IO_OPS_PER_SECOND", 0)
+    latency_target = config.get("IO_LATENCY_TARGET_MS", 0) / 1000
+    schedule = [Window(**window) for window in config.get("IO_SCHEDULE", [])]
+    if not (bytes_per_second or ops_per_second or latency_target or schedule):
+        return None
+    return IOThrottle(bytes_per_second, ops_per_second, schedule, latency_target)
@@ -0,0 +1,187 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import stat
+import struct
+import time
+
+from FileSortLogging import SUMMARY
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+# Files with these suffixes are still being downloaded
+DEFAULT_IGNORE_SUFFIXES = [".part", ".crdownload", ".download", ".partial", ".tmp", ".!qb", ".opdownload"]
+# Longest sleep while waiting for the next expiry, the wall clock may jump while sleeping
+MAX_EXPIRY_SLEEP = 3600.0
+
+class InotifyWatcher:
+    """ Reports files in directories that were closed after writing or moved into them, Linux only """
+    def __init__(self, paths):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        # Watched directories by watch descriptor: {wd: path}
+        self.paths = {}
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for path in paths:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f"inotify_add_watch failed for {path}")
+            self.paths[wd] = path
+
+    def read_events(self, timeout=None) -> list:
+        """ Waits up to timeout seconds (forever if None) and returns the paths of changed files """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        names = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, report every file in the directories
+                logging.warning("inotify queue overflowed, rescanning download folders")
+                return [os.path.join(path, name) for path in self.paths.values() for name in os.listdir(path)]
+            if name and not mask & IN_ISDIR and wd in self.paths:
+                names.append(os.path.join(self.paths[wd], os.fsdecode(name)))
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class PollingWatcher:
+    """ Fallback for systems without inotify, compares directory snapshots every interval seconds """
+    def __init__(self, paths, interval=2.0):
+        self.paths = list(paths)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict:
+        snapshot = {}
+        for path in self.paths:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    except FileNotFoundError:
+                        continue
+        return snapshot
+
+    def read_events(self, timeout=None) -> list:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self.scan()
+        names = [name for name, state in snapshot.items() if self.snapshot.get(name) != state]
+        self.snapshot = snapshot
+        return names
+
+    def close(self) -> None:
+        pass
+
+class FileWatcher:
+    """ Sorts new files in the download folders as soon as they finished downloading
+        A file is sorted once its size and mtime did not change for settle_time seconds.
+    """
+    def __init__(self, file_sorter, paths, settle_time=0.5, ignore_suffixes=None, use_inotify=True):
+        self.file_sorter = file_sorter
+        self.paths = list(paths)
+        self.settle_time = settle_time
+        self.ignore_suffixes = tuple(suffix.lower() for suffix in (ignore_suffixes or DEFAULT_IGNORE_SUFFIXES))
+        self.running = False
+        # Files waiting to become stable: {path: ((size, mtime_ns), time of the last change)}
+        self.pending: dict = {}
+
+        self.watcher = None
+        if use_inotify:
+            try:
+                self.watcher = InotifyWatcher(self.paths)
+                logging.log(SUMMARY, f"Watching {', '.join(self.paths)} with inotify")
+            except (OSError, AttributeError) as e:
+                logging.warning(f"inotify not available ({e}), falling back to polling")
+        if self.watcher is None:
+            self.watcher = PollingWatcher(self.paths)
+            logging.log(SUMMARY, f"Watching {', '.join(self.paths)} by polling every {self.watcher.interval} seconds")
+
+    def is_ignored(self, path) -> bool:
+        name = os.path.basename(path)
+        return name.startswith(".") or name.lower().endswith(self.ignore_suffixes)
+
+    def file_state(self, path):
+        """ Returns (size, mtime_ns) of a regular file, None if it is gone or not a file """
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        return (file_stat.st_size, file_stat.st_mtime_ns)
+
+    def process_events(self, paths) -> None:
+        now = time.monotonic()
+        for path in paths:
+            if not self.is_ignored(path):
+                self.pending[path] = (self.file_state(path), now)
+
+    def sort_stable_files(self) -> None:
+        now = time.monotonic()
+        for path, (state, changed) in list(self.pending.items()):
+            if now - changed < self.settle_time:
+                continue
+            current = self.file_state(path)
+            if current is None:
+                del self.pending[path]
+            elif current != state:
+                self.pending[path] = (current, now)
+            else:
+                del self.pending[path]
+                try:
+                    self.file_sorter.sort_file(path)
+                except OSError as e:
+                    logging.error(f"Could not sort {path}: {e}")
+
+    def next_timeout(self):
+        """ Sleep until the next pending file could be stable or the next file expires, forever when neither is due """
+        timeouts = []
+        if self.pending:
+            oldest = min(changed for _, changed in self.pending.values())
+            timeouts.append(max(0.0, oldest + self.settle_time - time.monotonic()))
+        expires = self.file_sorter.next_expiry()
+        if expires is not None:
+            timeouts.append(min(MAX_EXPIRY_SLEEP, max(0.0, expires - time.time())))
+        return min(timeouts, default=None)
+
+    def run(self) -> None:
+        self.running = True
+        try:
+            while self.running:
+                self.process_events(self.watcher.read_events(self.next_timeout()))
+                self.sort_stable_files()
+                self.file_sorter.expire_files()
+        finally:
+            self.watcher.close()
+
+    def stop(self) -> None:
+        self.running = False
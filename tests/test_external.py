@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import FileSort
+from FileSort import FileSorter
+from FileSortExternal import Record, decode_record, encode_record
+from FileSortProgress import SortCancelled
+
+
+class ExternalDuplicateTest(unittest.TestCase):
+    """ Files edited in place after they were hashed must not be removed as duplicates """
+
+    def setUp(self):
+        self.previous = os.getcwd()
+        self.workspace = tempfile.mkdtemp()
+        os.chdir(self.workspace)
+        self.download = os.path.join(self.workspace, "dl")
+        os.makedirs(self.download)
+        config = {"DOWNLOAD_FOLDER_PATH": self.download, "ALLOW_DUPLICATES": False, "DELETE_LOGS_AFTER_DAYS": -1,
+                  "DELETE_FILES_AFTER_DAYS": -1, "FOLDERS": {"Docs": [".txt"]}, "DEDUPE_MODE": "external",
+                  "JOURNAL": False, "METRICS_DIR": None, "HASH_WORKERS": 1}
+        with open("config.json", "w") as f:
+            json.dump(config, f)
+        for name in ("a.bin", "b.bin"):
+            with open(os.path.join(self.download, name), "wb") as f:
+                f.write(b"x" * 20000)
+
+    def tearDown(self):
+        os.chdir(self.previous)
+        shutil.rmtree(self.workspace)
+
+    def run_sorter(self, edit=None):
+        sorter = FileSorter({})
+        plan_records = sorter.plan_duplicate_records
+
+        def edit_first(*args, **kwargs):
+            if edit is not None:
+                edit()
+            return plan_records(*args, **kwargs)
+
+        try:
+            with mock.patch.object(sorter, "plan_duplicate_records", edit_first):
+                sorter.start_sorting("rm_duplicates")
+        finally:
+            sorter.hash_cache.close()
+        return sorter
+
+    def test_record_round_trip(self):
+        record = Record(20000, "abc", "/tmp/a\tb.bin", 2049, 12, 1_700_000_000_123_456_789)
+        self.assertEqual(decode_record(encode_record(record)), record)
+
+    def test_file_edited_after_hashing_is_kept(self):
+        path = os.path.join(self.download, "b.bin")
+
+        def edit():
+            with open(path, "r+b") as f:
+                f.write(b"y" * 20000)
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        sorter = self.run_sorter(edit)
+        self.assertEqual(sorter.filesRemoved, 0)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"y" * 20000)
+
+    def test_unchanged_duplicate_is_removed(self):
+        sorter = self.run_sorter()
+        self.assertEqual(sorter.filesRemoved, 1)
+        self.assertEqual(sorted(os.listdir(self.download)), ["Docs", "a.bin"])
+
+    def test_resume_during_merge_keeps_the_hashed_stage(self):
+        with open("config.json") as f:
+            config = json.load(f)
+        # A few records per run, so every stage is merged in several passes
+        config.update(DEDUPE_MEMORY=4096, HASH_CACHE=False)
+        with open("config.json", "w") as f:
+            json.dump(config, f)
+        for number in range(30):
+            for copy in ("a", "b"):
+                with open(os.path.join(self.download, f"{copy}{number:02d}.bin"), "wb") as f:
+                    f.write(b"%02d" % number * 5000)
+
+        def interrupt_full_merge(paths, directory, prefix, fan_in):
+            if prefix.startswith("full"):
+                raise SortCancelled()
+            return merge_pass(paths, directory, prefix, fan_in)
+
+        merge_pass = FileSort.merge_pass
+        sorter = FileSorter({})
+        with mock.patch.object(FileSort, "merge_pass", interrupt_full_merge):
+            sorter.start_sorting("rm_duplicates")
+        self.assertEqual(sorter.filesRemoved, 0)
+
+        sorter = FileSorter({})
+        sorter.start_sorting("rm_duplicates")
+        # The 30 pairs and a.bin and b.bin of setUp
+        self.assertEqual(sorter.filesRemoved, 31)
+        self.assertEqual(sorter.metrics.counters.get("bytes_hashed", 0), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import FileSortPlan
+from FileSort import FileSorter
+
+
+def fake_clone(source, target):
+    """ Stands in for FICLONE on file systems without reflinks, the copy gets its own inode like a reflink """
+    with open(target, "xb"):
+        pass
+    shutil.copyfile(source, target)
+
+
+class LinkedDuplicateTest(unittest.TestCase):
+    """ Reflinks of an earlier run must not be trusted once their origin was edited in place """
+
+    def setUp(self):
+        self.previous = os.getcwd()
+        self.workspace = tempfile.mkdtemp()
+        os.chdir(self.workspace)
+        self.download = os.path.join(self.workspace, "dl")
+        os.makedirs(os.path.join(self.download, "Docs"))
+        self.write_config("reflink")
+
+    def tearDown(self):
+        os.chdir(self.previous)
+        shutil.rmtree(self.workspace)
+
+    def write_config(self, action):
+        config = {"DOWNLOAD_FOLDER_PATH": self.download, "ALLOW_DUPLICATES": False, "DELETE_LOGS_AFTER_DAYS": -1,
+                  "DELETE_FILES_AFTER_DAYS": -1, "FOLDERS": {"Docs": [".txt"]}, "DUPLICATE_ACTION": action,
+                  "JOURNAL": False, "METRICS_DIR": None, "HASH_WORKERS": 1}
+        with open("config.json", "w") as f:
+            json.dump(config, f)
+
+    def run_sorter(self, *args):
+        sorter = FileSorter({})
+        try:
+            with mock.patch.object(FileSortPlan, "clone_file", fake_clone):
+                sorter.start_sorting(*args)
+        finally:
+            sorter.hash_cache.close()
+        return sorter
+
+    def write(self, name, content):
+        path = os.path.join(self.download, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def edit_in_place(self, path, content):
+        """ Same size, new content, the inode is kept """
+        with open(path, "r+b") as f:
+            f.write(content)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_rm_duplicates_keeps_reflink_of_edited_origin(self):
+        original = self.write("a.bin", b"x" * 20000)
+        duplicate = self.write("b.bin", b"x" * 20000)
+        sorter = self.run_sorter("rm_duplicates")
+        self.assertEqual(sorter.filesLinked, 1)
+
+        self.edit_in_place(original, b"y" * 20000)
+        self.write_config("delete")
+        sorter = self.run_sorter("rm_duplicates")
+        self.assertEqual(sorter.filesRemoved, 0)
+        with open(duplicate, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 20000)
+
+    def test_sort_moves_reflink_of_edited_origin(self):
+        stored = self.write(os.path.join("Docs", "a.txt"), b"x" * 20000)
+        self.write("a.txt", b"x" * 20000)
+        sorter = self.run_sorter()
+        self.assertEqual(sorter.filesLinked, 1)
+
+        self.edit_in_place(stored, b"y" * 20000)
+        self.write_config("delete")
+        sorter = self.run_sorter()
+        self.assertEqual(sorter.filesRemoved, 0)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.download, "Docs"))), ["a.txt", "a_1.txt"])
+
+    def test_unchanged_reflink_is_not_hashed_again(self):
+        self.write("a.bin", b"x" * 20000)
+        self.write("b.bin", b"x" * 20000)
+        self.run_sorter("rm_duplicates")
+        self.write_config("delete")
+        sorter = self.run_sorter("rm_duplicates")
+        self.assertEqual(sorter.filesRemoved, 1)
+        self.assertEqual(sorter.metrics.counters.get("bytes_hashed", 0), 0)
+
+    def test_reused_inode_of_stored_file_is_not_trusted(self):
+        stored = self.write(os.path.join("Docs", "a.txt"), b"x" * 20000)
+        incoming = self.write("b.txt", b"y" * 20000)
+        sorter = FileSorter({})
+        try:
+            index = sorter.get_content_index()
+            # The stored file was copied away and its old inode now belongs to the new download
+            stat = os.stat(incoming)
+            index.inodes[stored] = (stat.st_dev, stat.st_ino, *index.get_inode(stored)[2:])
+            self.assertIsNone(sorter.find_stored_duplicate(incoming, 20000))
+        finally:
+            sorter.hash_cache.close()
+
+    def test_moved_entry_takes_the_inode_of_its_copy(self):
+        stored = self.write(os.path.join("Docs", "a.txt"), b"x" * 20000)
+        copy = self.write(os.path.join("Docs", "b.txt"), b"x" * 20000)
+        sorter = FileSorter({})
+        try:
+            index = sorter.get_content_index()
+            index.discard(copy)
+            stat = os.stat(copy)
+            index.move(stored, copy, stat)
+            self.assertEqual(index.get_inode(copy), (stat.st_dev, stat.st_ino, stat.st_mtime_ns))
+        finally:
+            sorter.hash_cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
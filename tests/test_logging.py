@@ -0,0 +1,49 @@
+import glob
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from FileSortLogging import setup_logging, shutdown_logging
+
+
+class LogFlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.level = logging.getLogger().level
+        setup_logging(self.log_dir, flush_interval=0.2)
+
+    def tearDown(self):
+        shutdown_logging()
+        logging.getLogger().setLevel(self.level)
+        shutil.rmtree(self.log_dir)
+
+    def read_log(self) -> str:
+        paths = glob.glob(os.path.join(self.log_dir, "*.log"))
+        if not paths:
+            return ""
+        with open(paths[0], encoding="utf-8") as f:
+            return f.read()
+
+    def test_lines_are_flushed_after_an_idle_interval(self):
+        logging.info("first line")
+        time.sleep(0.05)
+        logging.info("x.pdf was moved to Docs")
+        time.sleep(1.0)
+        content = self.read_log()
+        self.assertIn("first line", content)
+        self.assertIn("x.pdf was moved to Docs", content)
+
+    def test_warnings_are_flushed_immediately(self):
+        logging.warning("disk full")
+        deadline = time.monotonic() + 0.15
+        while "disk full" not in self.read_log() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIn("disk full", self.read_log())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from FileSortGUI import LogViewer
+from FileSortLogView import LogIndex
+
+
+class Variable:
+    """ Stands in for a tkinter variable, no display is needed """
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class FindNextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "OutputLog.log")
+        with open(path, "w", encoding="utf-8") as f:
+            for number in range(60):
+                text = "needle" if number in (10, 25, 40) else "hay"
+                f.write(f"2024-01-01 00:00:00,000 - INFO - line {number} {text}\n")
+        index = LogIndex(path)
+        index.update()
+
+        # The viewer without its window, render only records the highlighted line
+        self.viewer = LogViewer.__new__(LogViewer)
+        self.viewer.index = index
+        self.viewer.first = 0
+        self.viewer.rows = 5
+        self.viewer.last_match = None
+        self.viewer.last_search = None
+        self.viewer.search_var = Variable("needle")
+        self.viewer.follow_var = Variable(True)
+        self.viewer.status_label = mock.Mock()
+        self.matches = []
+        self.viewer.render = lambda match=None: self.matches.append(match)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_steps_through_all_matches_and_wraps(self):
+        for _ in range(5):
+            self.viewer.find_next()
+        self.assertEqual(self.matches, [10, 25, 40, 10, 25])
+        self.assertFalse(self.viewer.follow_var.get())
+
+    def test_new_text_starts_at_the_screen(self):
+        self.viewer.find_next()
+        self.viewer.find_next()
+        self.viewer.search_var.set("line 5")
+        self.viewer.find_next()
+        # The screen starts two lines above the last match
+        self.assertEqual(self.matches[-1], 50)
+
+    def test_missing_text(self):
+        self.viewer.search_var.set("nothing")
+        self.viewer.find_next()
+        self.assertEqual(self.matches, [])
+        self.viewer.status_label.config.assert_called_with(text="nothing not found")
+
+
+if __name__ == "__main__":
+    unittest.main()
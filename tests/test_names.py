@@ -0,0 +1,28 @@
+import unittest
+
+from FileSort import NameIndex
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def test_counter_is_appended(self):
+        names = NameIndex(["invoice.pdf"])
+        self.assertEqual(names.next_name("invoice.pdf"), "invoice_1.pdf")
+
+    def test_highest_counter_of_the_folder_is_continued(self):
+        names = NameIndex(["invoice.pdf", "invoice_1.pdf", "invoice_12.pdf"])
+        self.assertEqual(names.next_name("invoice.pdf"), "invoice_13.pdf")
+
+    def test_name_with_a_counter_continues_it(self):
+        names = NameIndex(["name_7.pdf"])
+        self.assertEqual(names.next_name("name_7.pdf"), "name_8.pdf")
+        names.add("name_8.pdf")
+        self.assertEqual(names.next_name("name_7.pdf"), "name_9.pdf")
+
+    def test_incoming_counter_below_the_folder_counter(self):
+        names = NameIndex(["name.pdf", "name_3.pdf", "name_12.pdf"])
+        self.assertEqual(names.next_name("name_3.pdf"), "name_13.pdf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from FileSort import FileSorter
+
+
+class RootSorterTest(unittest.TestCase):
+    """ Several download folders share the hash workers of the sorter that created them """
+
+    def setUp(self):
+        self.previous = os.getcwd()
+        self.workspace = tempfile.mkdtemp()
+        os.chdir(self.workspace)
+        self.downloads = [os.path.join(self.workspace, name) for name in ("first", "second")]
+        for download in self.downloads:
+            os.makedirs(os.path.join(download, "Docs"))
+        config = {"DOWNLOAD_FOLDER_PATH": self.downloads[0], "DOWNLOAD_FOLDER_PATHS": self.downloads[1:],
+                  "ALLOW_DUPLICATES": False, "DELETE_LOGS_AFTER_DAYS": -1, "DELETE_FILES_AFTER_DAYS": -1,
+                  "FOLDERS": {"Docs": [".txt"]}, "JOURNAL": False, "METRICS_DIR": None, "HASH_WORKERS": 2}
+        with open("config.json", "w") as f:
+            json.dump(config, f)
+
+    def tearDown(self):
+        os.chdir(self.previous)
+        shutil.rmtree(self.workspace)
+
+    def write(self, path, content):
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def test_new_file_is_hashed_after_the_run(self):
+        sorter = FileSorter({})
+        try:
+            sorter.start_sorting()
+            # Like watch mode: a new download that has two stored files of its size to compare with
+            docs = os.path.join(self.downloads[1], "Docs")
+            self.write(os.path.join(docs, "a.txt"), b"a" * 20000)
+            self.write(os.path.join(docs, "b.txt"), b"b" * 20000)
+            incoming = os.path.join(self.downloads[1], "b.txt")
+            self.write(incoming, b"b" * 20000)
+            sorter.sort_file(incoming)
+            self.assertFalse(os.path.exists(incoming))
+        finally:
+            sorter.shutdown_hash_workers()
+            sorter.hash_cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
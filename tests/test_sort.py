@@ -0,0 +1,93 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+from FileSort import FileSorter
+
+
+class SortTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = os.getcwd()
+        self.workspace = tempfile.mkdtemp()
+        os.chdir(self.workspace)
+        self.download = os.path.join(self.workspace, "dl")
+        os.makedirs(os.path.join(self.download, "sub"))
+        self.write_config()
+
+    def tearDown(self):
+        os.chdir(self.previous)
+        shutil.rmtree(self.workspace)
+
+    def write_config(self, **settings):
+        config = {"DOWNLOAD_FOLDER_PATH": self.download, "ALLOW_DUPLICATES": False, "DELETE_LOGS_AFTER_DAYS": -1,
+                  "DELETE_FILES_AFTER_DAYS": -1, "FOLDERS": {"Docs": [".txt"]}, "JOURNAL": False,
+                  "METRICS_DIR": None, "HASH_WORKERS": 1, **settings}
+        with open("config.json", "w") as f:
+            json.dump(config, f)
+
+    def write(self, name, content):
+        with open(os.path.join(self.download, name), "wb") as f:
+            f.write(content)
+
+    def run_sorter(self, *args):
+        sorter = FileSorter({})
+        try:
+            sorter.start_sorting(*args)
+        finally:
+            sorter.hash_cache.close()
+        return sorter
+
+    def test_symlink_loop_is_not_followed(self):
+        self.write(os.path.join("sub", "a.bin"), b"x" * 100)
+        self.write(os.path.join("sub", "b.bin"), b"x" * 100)
+        os.symlink(self.download, os.path.join(self.download, "sub", "loop"))
+        sorter = self.run_sorter("rm_duplicates")
+        self.assertEqual(sorter.filesRemoved, 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.download, "sub"))), ["a.bin", "loop"])
+
+    def test_recursive_sort_counts_files_while_sorting(self):
+        self.write_config(RECURSIVE_SORT=True)
+        self.write("a.txt", b"a")
+        self.write(os.path.join("sub", "b.txt"), b"b")
+        self.write(os.path.join("sub", "c.bin"), b"c")
+        sorter = FileSorter({})
+        sorter.progress_queue = queue.SimpleQueue()
+        try:
+            sorter.start_sorting()
+        finally:
+            sorter.hash_cache.close()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.download, "Docs"))), ["a.txt", "b.txt"])
+        # Every folder is listed once, sub is not walked a second time for the progress total
+        self.assertEqual(sorter.metrics.counters["listdir_calls"], 2)
+        events = []
+        while not sorter.progress_queue.empty():
+            events.append(sorter.progress_queue.get())
+        sorting = [event for event in events if event.task == "Sorting files"]
+        self.assertEqual((sorting[-1].done, sorting[-1].total), (3, 3))
+        self.assertTrue(all(event.done <= event.total for event in sorting))
+
+    def test_duplicate_search_counts_files_while_scanning(self):
+        self.write("a.bin", b"a")
+        self.write(os.path.join("sub", "b.bin"), b"b")
+        self.write(os.path.join("sub", "c.bin"), b"b")
+        sorter = FileSorter({})
+        sorter.progress_queue = queue.SimpleQueue()
+        try:
+            sorter.start_sorting("rm_duplicates")
+        finally:
+            sorter.hash_cache.close()
+        self.assertEqual(sorter.filesRemoved, 1)
+        # The listing of the download folder is kept from sorting, only sub is listed by the duplicate search
+        self.assertEqual(sorter.metrics.counters["listdir_calls"], 2)
+        events = []
+        while not sorter.progress_queue.empty():
+            events.append(sorter.progress_queue.get())
+        removing = [event for event in events if event.task == "Removing duplicates"]
+        self.assertEqual((removing[-1].done, removing[-1].total), (3, 3))
+
+if __name__ == "__main__":
+    unittest.main()